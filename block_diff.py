@@ -0,0 +1,105 @@
+# block_diff.py
+import json
+import random
+import time
+import zlib
+
+
+def diff_blocks(old_data, new_data, block_size=256):
+    """Offset dei blocchi cambiati tra due copie della stessa pagina"""
+    if old_data == new_data:
+        return []
+
+    old_view = memoryview(old_data)
+    new_view = memoryview(new_data)
+    size = min(len(old_view), len(new_view))
+    return [
+        offset for offset in range(0, size, block_size)
+        if old_view[offset:offset + block_size] != new_view[offset:offset + block_size]
+    ]
+
+
+def changed_offsets(old_data, new_data, start, end):
+    """Offset dei singoli byte cambiati in [start, end)"""
+    return [i for i in range(start, min(end, len(old_data), len(new_data))) if old_data[i] != new_data[i]]
+
+
+def encode_blocks(data, offsets, block_size=256):
+    """Blocchi da trasmettere come [offset, hex]"""
+    return [[offset, data[offset:offset + block_size].hex()] for offset in offsets]
+
+
+def apply_blocks(data, blocks):
+    """Applica blocchi [offset, hex] a una copia della pagina"""
+    page = bytearray(data)
+    for offset, block_hex in blocks:
+        block = bytes.fromhex(block_hex)
+        page[offset:offset + len(block)] = block
+    return bytes(page)
+
+
+def block_hashes(data, block_size=256):
+    """CRC32 per blocco, per confrontare pagine senza trasferirle"""
+    view = memoryview(data)
+    return [zlib.crc32(view[offset:offset + block_size]) for offset in range(0, len(view), block_size)]
+
+
+def benchmark_block_sizes(block_sizes=(16, 64, 256, 1024, 4096), pages=512, page_size=4096,
+                          counters_per_page=4, structs_per_page=1, struct_size=96, seed=26):
+    """Confronta byte di delta e costo CPU del diff al variare della granularità"""
+    rng = random.Random(seed)
+    old_pages = [bytes(rng.getrandbits(8) for _ in range(page_size)) for _ in range(pages)]
+    new_pages = []
+    for page in old_pages:
+        page = bytearray(page)
+        # Contatori sparsi da 4 byte e qualche struttura contigua
+        for _ in range(counters_per_page):
+            offset = rng.randrange(0, page_size - 4, 4)
+            page[offset:offset + 4] = rng.getrandbits(32).to_bytes(4, 'little')
+        for _ in range(structs_per_page):
+            offset = rng.randrange(0, page_size - struct_size)
+            page[offset:offset + struct_size] = bytes(rng.getrandbits(8) for _ in range(struct_size))
+        new_pages.append(bytes(page))
+
+    results = []
+
+    # Riferimento: formato storico a coppie (offset, byte)
+    started = time.perf_counter()
+    delta = {
+        hex(i * page_size): {'changes': [(j, new[j]) for j in changed_offsets(old, new, 0, page_size)]}
+        for i, (old, new) in enumerate(zip(old_pages, new_pages))
+    }
+    results.append({
+        'block_size': 'byte',
+        'delta_bytes': len(json.dumps(delta)),
+        'diff_ms': (time.perf_counter() - started) * 1000
+    })
+
+    for block_size in block_sizes:
+        started = time.perf_counter()
+        delta = {}
+        for i, (old, new) in enumerate(zip(old_pages, new_pages)):
+            offsets = diff_blocks(old, new, block_size)
+            delta[hex(i * page_size)] = {'blocks': encode_blocks(new, offsets, block_size)}
+        diff_ms = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        for page in new_pages:
+            block_hashes(page, block_size)
+        hash_ms = (time.perf_counter() - started) * 1000
+
+        results.append({
+            'block_size': block_size,
+            'delta_bytes': len(json.dumps(delta)),
+            'diff_ms': diff_ms,
+            'hash_ms': hash_ms
+        })
+
+    return results
+
+
+if __name__ == "__main__":
+    for result in benchmark_block_sizes():
+        hash_text = f", hash {result['hash_ms']:.2f} ms" if 'hash_ms' in result else ''
+        print(f"📊 blocco {str(result['block_size']):>5}: delta {result['delta_bytes'] / 1024:8.1f} KB, "
+              f"diff {result['diff_ms']:.2f} ms{hash_text}")
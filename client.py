@@ -1,86 +1,183 @@
 # client_slave.py
-import pymem
 import paho.mqtt.client as mqtt
 import json
 import threading
 import time
 import subprocess
 import struct
+import uuid
+from memory_sync import MemorySyncEngine
+from transport import decode_message
+from lockstep import LockstepSession
+from memory_backend import create_backend
+from readiness import ReadinessProbe
+from profiler import get_profiler
 
 class FCClientSlave:
-    def __init__(self, broker_ip="localhost", game_path="fc26.exe"):
+    def __init__(self, broker_ip="localhost", game_path="fc26.exe", role="player",
+                 sync_mode="continuous"):
         self.broker_ip = broker_ip
         self.game_path = game_path
+        self.role = role  # 'player' o 'observer' (spettatore senza input)
+        self.sync_mode = sync_mode  # 'continuous' o 'lockstep' (deve coincidere col master)
+        self.lockstep = None
+        self.frame_interval = 0.016  # stesso passo del loop di sync del master
+        self.session_id = uuid.uuid4().hex[:8]
         self.pm = None
         self.game_pid = None
         
-        # Memoria
-        self.memory_snapshot = {}
-        self.memory_regions_map = {}
+        # Avvio: client_ready solo con il gioco pronto e la memoria stabile
+        self.quiet_period = 2.0
+        self.ready_timeout = 60.0
+        self.startup_timings = {}
+        self.start_time = None
+        
+        # Strumentazione per fase: spenta di default, metrics_port la attiva
+        self.profiler = get_profiler()
+        self.metrics_port = None
+        self.metrics_sample_every = 100
+        
+        # Memoria (applicata tramite il motore di sincronizzazione)
+        self.sync_engine = None
         
         # Input
         self.local_inputs = {}
         self.remote_inputs = {}
         
-        # Configurazione MQTT
-        self.client = mqtt.Client("FC26_Client")
-        self.setup_mqtt()
-        
         # Sincronizzazione
         self.running = True
         self.ready = False
+        self.last_seq = {}  # corsia -> ultimo seq applicato
+        self.ack_interval = 0.1
+        self.last_ack = 0
+        self.apply_ms = 0.0  # media del tempo di applicazione per delta
+        
+        # Riparazione buchi: request_id -> (istante invio, pagine richieste)
+        self.pending_repairs = {}
+        self.repair_counter = 0
+        self.repair_timeout = 1.0
+        self.sync_stats = {
+            'gaps': 0,
+            'repairs_requested': 0,
+            'repairs_applied': 0,
+            'pages_repaired': 0,
+            'repair_latency_ms_total': 0.0,
+            'repair_latency_ms_max': 0.0
+        }
+        
+        # Configurazione MQTT (client id univoco: più client sullo stesso master)
+        self.client = mqtt.Client(f"FC26_Client_{self.session_id}")
+        self.setup_mqtt()
         
     def setup_mqtt(self):
         """Configurazione MQTT Client"""
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
-        self.client.connect(self.broker_ip, 1883, 60)
         
         self.topics = {
             'memory_delta': 'fc26/master/memory_delta',
+            'memory_critical': 'fc26/master/memory_critical',
             'input_from_master': 'fc26/master/input',
             'input_to_master': 'fc26/client/input',
+            'session_memory': f'fc26/client/{self.session_id}/memory',
+            'ping': 'fc26/master/ping',
+            'calibration': 'fc26/master/calibration',
+            'checksum': 'fc26/master/checksum',
             'control': 'fc26/control'
         }
+        
+        # Uscita senza stop() (crash, rete persa): il broker avvisa il master
+        leave_msg = {'command': 'client_leave', 'session_id': self.session_id}
+        self.client.will_set(self.topics['control'], json.dumps(leave_msg))
+        self.client.connect(self.broker_ip, 1883, 60)
     
     def on_connect(self, client, userdata, flags, rc):
         print(f"✅ Client connesso al broker MQTT")
         # Iscrizione ai topic del master
         self.client.subscribe(self.topics['memory_delta'])
+        self.client.subscribe(self.topics['memory_critical'])
+        self.client.subscribe(self.topics['session_memory'])
+        self.client.subscribe(self.topics['ping'])
+        self.client.subscribe(self.topics['calibration'])
+        self.client.subscribe(self.topics['checksum'])
         self.client.subscribe(self.topics['input_from_master'])
         
     def on_message(self, client, userdata, msg):
         """Gestione messaggi dal master"""
+        memory_topic = msg.topic in (self.topics['memory_delta'], self.topics['memory_critical'],
+                                     self.topics['session_memory'])
+        if memory_topic:
+            # Un tick per messaggio di memoria: decode + apply
+            self.profiler.begin_tick('apply')
         try:
-            payload = json.loads(msg.payload.decode())
+            with self.profiler.stage('decode'):
+                payload = decode_message(msg.payload)
             
-            if msg.topic == self.topics['memory_delta']:
+            if memory_topic:
+                if self.lockstep is not None and payload.get('type') == 'page_repair':
+                    self.lockstep.record_bytes('repair', len(msg.payload))
                 self.process_memory_update(payload)
                 
             elif msg.topic == self.topics['input_from_master']:
                 # Input dal master (Controller 1 remoto)
                 self.remote_inputs = payload['inputs']
+                if self.lockstep is not None:
+                    self.lockstep.record_remote_inputs(payload)
                 self.inject_remote_inputs()
+            
+            elif msg.topic == self.topics['calibration']:
+                self.report_divergence(payload)
+            
+            elif msg.topic == self.topics['checksum']:
+                # Confrontato nel loop lockstep quando il frame locale lo raggiunge
+                if self.lockstep is not None and self.ready:
+                    self.lockstep.queue_remote_checksum(payload)
+            
+            elif msg.topic == self.topics['ping']:
+                # Eco per la misura dell'RTT del master
+                pong_msg = {'command': 'pong', 'session_id': self.session_id, 't': payload['t']}
+                self.client.publish(self.topics['control'], json.dumps(pong_msg))
                 
         except Exception as e:
             print(f"❌ Errore messaggio MQTT: {e}")
+        
+        if memory_topic:
+            self.profiler.end_tick()
     
     def launch_game(self):
         """Avvia processo gioco identico"""
         try:
             print("🎮 Avvio FC26 (Client)...")
+            started = time.perf_counter()
             process = subprocess.Popen([self.game_path])
             self.game_pid = process.pid
-            time.sleep(5)  # Attendi caricamento
             
-            # Connetti alla memoria
+            # Connetti alla memoria (pymem importato solo qui)
+            import pymem
             self.pm = pymem.Pymem()
             self.pm.open_process_from_id(self.game_pid)
             
+            # Attendi moduli caricati e memoria stabile prima di chiedere lo snapshot
+            probe = ReadinessProbe(
+                self.game_pid, backend=create_backend(self.pm),
+                quiet_period=self.quiet_period, timeout=self.ready_timeout
+            )
+            if not probe.wait():
+                print("⚠️ Gioco non stabile entro il timeout, proseguo comunque")
+            self.startup_timings.update(probe.timings)
+            self.startup_timings['launch_s'] = time.perf_counter() - started
+            self.sync_engine = MemorySyncEngine(self.pm, role="client")
+            if self.sync_mode == 'lockstep':
+                self.lockstep = LockstepSession(self.sync_engine)
+            
             print(f"✅ Gioco client avviato (PID: {self.game_pid})")
             
             # Notifica al master che siamo pronti
-            ready_msg = {'command': 'client_ready'}
+            ready_msg = {
+                'command': 'client_ready',
+                'session_id': self.session_id,
+                'role': self.role
+            }
             self.client.publish(
                 self.topics['control'],
                 json.dumps(ready_msg)
@@ -97,59 +194,177 @@ class FCClientSlave:
         update_type = update_data.get('type')
         
         if update_type == 'full_snapshot':
+            # I delta più vecchi dello snapshot non vanno più applicati
+            for lane, seq in update_data.get('seq', {}).items():
+                self.last_seq[lane] = max(self.last_seq.get(lane, 0), seq)
             self.apply_full_snapshot(update_data)
+            if self.lockstep is not None and 'frame' in update_data:
+                self.lockstep.frame = max(self.lockstep.frame, update_data['frame'])
             self.ready = True
             print("✅ Snapshot applicato - Sincronizzato!")
+            if 'first_sync_s' not in self.startup_timings and self.start_time is not None:
+                self.startup_timings['first_sync_s'] = time.perf_counter() - self.start_time
+                print(f"⏱️ Primo sync dopo {self.startup_timings['first_sync_s']:.2f}s dall'avvio")
             
         elif update_type == 'delta_changes':
             if self.ready:
+                lane = update_data.get('lane', 'bulk')
+                seq = update_data.get('seq', 0)
+                last_seq = self.last_seq.get(lane, 0)
+                
+                if seq > last_seq + 1:
+                    # Buco nella sequenza: chiedi solo le pagine dei delta persi
+                    self.sync_stats['gaps'] += 1
+                    self.request_repair(lane=lane, from_seq=last_seq + 1, to_seq=seq - 1)
+                
+                # I delta in ritardo si applicano comunque: le versioni per pagina
+                # scartano quelle già superate
+                started = time.perf_counter()
                 self.apply_delta_changes(update_data)
+                apply_ms = (time.perf_counter() - started) * 1000
+                self.apply_ms += 0.2 * (apply_ms - self.apply_ms)
+                self.last_seq[lane] = max(seq, last_seq)
+                
+                # Pagine con versioni saltate nel delta stesso
+                candidates = self.sync_engine.repair_candidates - self.pending_repair_pages()
+                if candidates:
+                    self.request_repair(pages=candidates)
+                
+                self.send_ack()
+        
+        elif update_type == 'page_repair':
+            self.apply_page_repair(update_data)
+    
+    def pending_repair_pages(self):
+        """Pagine già richieste in riparazioni non ancora scadute"""
+        now = time.time()
+        pages = set()
+        for request_id, (sent_at, request_pages) in list(self.pending_repairs.items()):
+            if now - sent_at > self.repair_timeout:
+                del self.pending_repairs[request_id]
+                continue
+            pages.update(request_pages)
+        return pages
+    
+    def request_repair(self, lane=None, from_seq=None, to_seq=None, pages=None, force=False):
+        """Chiede al master le pagine mancanti alla loro versione corrente"""
+        self.repair_counter += 1
+        request_id = f"{self.session_id}-{self.repair_counter}"
+        pages = set(pages or ())
+        
+        repair_msg = {
+            'command': 'repair',
+            'session_id': self.session_id,
+            'request_id': request_id,
+            'pages': {
+                hex(page_addr): self.sync_engine.known_version(page_addr)
+                for page_addr in pages
+            }
+        }
+        if lane is not None:
+            repair_msg.update({'lane': lane, 'from_seq': from_seq, 'to_seq': to_seq})
+        if force:
+            # Checksum divergente: le versioni coincidono ma il contenuto no.
+            # Il totale dei desync va al master, l'unico che vede tutte le sessioni
+            repair_msg['force'] = True
+            if self.lockstep is not None:
+                repair_msg['desyncs'] = self.lockstep.stats['desyncs']
+        
+        self.pending_repairs[request_id] = (time.time(), pages)
+        self.sync_stats['repairs_requested'] += 1
+        self.client.publish(self.topics['control'], json.dumps(repair_msg))
+    
+    def apply_page_repair(self, repair_data):
+        """Applica le pagine di riparazione e misura la latenza"""
+        repaired = self.sync_engine.apply_memory_changes(repair_data)
+        
+        request = self.pending_repairs.pop(repair_data.get('request_id'), None)
+        if request is not None:
+            latency_ms = (time.time() - request[0]) * 1000
+            self.sync_stats['repair_latency_ms_total'] += latency_ms
+            self.sync_stats['repair_latency_ms_max'] = max(
+                self.sync_stats['repair_latency_ms_max'], latency_ms
+            )
+        
+        self.sync_stats['repairs_applied'] += 1
+        self.sync_stats['pages_repaired'] += repaired
+    
+    def report_divergence(self, check_data):
+        """Calibrazione: segnala le pagine che il gioco locale ha cambiato rispetto al master"""
+        if not self.ready or self.sync_engine is None:
+            return
+        pages = self.sync_engine.divergent_pages(
+            [int(page_addr_hex, 16) for page_addr_hex in check_data.get('pages', [])]
+        )
+        if pages:
+            divergence_msg = {
+                'command': 'divergence',
+                'session_id': self.session_id,
+                'pages': [hex(page_addr) for page_addr in pages]
+            }
+            self.client.publish(self.topics['control'], json.dumps(divergence_msg))
+    
+    def send_ack(self, force=False):
+        """Conferma al master i seq applicati (al massimo ogni ack_interval)"""
+        now = time.time()
+        if not force and now - self.last_ack < self.ack_interval:
+            return
+        self.last_ack = now
+        
+        ack_msg = {
+            'command': 'ack',
+            'session_id': self.session_id,
+            'seqs': self.last_seq,
+            'apply_ms': self.apply_ms
+        }
+        self.client.publish(self.topics['control'], json.dumps(ack_msg))
     
     def apply_full_snapshot(self, snapshot_data):
         """Applica snapshot completo dal master"""
         print("📥 Ricezione snapshot completo...")
-        
-        pages_applied = 0
-        for page_addr_hex, page_data_hex in snapshot_data['pages'].items():
-            try:
-                page_addr = int(page_addr_hex, 16)
-                page_data = bytes.fromhex(page_data_hex)
-                
-                # Scrivi nella memoria
-                self.pm.write_bytes(page_addr, page_data, len(page_data))
-                self.memory_snapshot[page_addr] = page_data
-                pages_applied += 1
-                
-            except Exception as e:
-                print(f"⚠️ Errore scrittura pagina {page_addr_hex}: {e}")
-        
-        print(f"✅ Snapshot applicato: {pages_applied} pagine")
+        self.sync_engine.apply_memory_changes(snapshot_data)
     
     def apply_delta_changes(self, delta_data):
         """Applica cambiamenti delta alla memoria locale"""
-        changes = delta_data.get('changes', {})
+        self.sync_engine.apply_memory_changes(delta_data)
+    
+    def get_sync_stats(self):
+        """Statistiche di sincronizzazione del client (buchi e riparazioni)"""
+        stats = self.sync_stats.copy()
+        if stats['repairs_applied'] > 0:
+            stats['avg_repair_latency_ms'] = stats['repair_latency_ms_total'] / stats['repairs_applied']
+        else:
+            stats['avg_repair_latency_ms'] = 0
+        stats['pending_repairs'] = len(self.pending_repairs)
+        stats['last_seq'] = dict(self.last_seq)
+        stats['startup'] = dict(self.startup_timings)
+        if self.sync_engine is not None:
+            stats['stale_pages_skipped'] = self.sync_engine.sync_stats['stale_pages_skipped']
+        if self.lockstep is not None:
+            stats['lockstep'] = self.lockstep.get_stats()
+        if self.profiler.enabled:
+            stats['stages'] = self.profiler.to_dict()['stages']
+        return stats
+    
+    def lockstep_loop(self):
+        """Avanza i frame locali e confronta i checksum del master"""
+        print("🔒 Avvio modalità lockstep...")
         
-        for page_addr_hex, change_info in changes.items():
+        while self.running:
             try:
-                page_addr = int(page_addr_hex, 16)
-                byte_changes = change_info['changes']
+                tick_start = time.perf_counter()
+                if self.ready:
+                    self.lockstep.next_frame()
+                    mismatched = self.lockstep.check_pending() - self.pending_repair_pages()
+                    if mismatched:
+                        self.request_repair(pages=mismatched, force=True)
                 
-                # Leggi dati correnti
-                current_data = bytearray(
-                    self.pm.read_bytes(page_addr, change_info['full_size'])
-                )
-                
-                # Applica cambiamenti
-                for offset, new_byte in byte_changes:
-                    if offset < len(current_data):
-                        current_data[offset] = new_byte
-                
-                # Scrivi dati modificati
-                self.pm.write_bytes(page_addr, bytes(current_data), len(current_data))
-                self.memory_snapshot[page_addr] = bytes(current_data)
+                elapsed = time.perf_counter() - tick_start
+                time.sleep(max(0.0, self.frame_interval - elapsed))
                 
             except Exception as e:
-                print(f"⚠️ Errore applicazione delta: {e}")
+                print(f"❌ Errore loop lockstep: {e}")
+                time.sleep(0.1)
     
     def input_capture_loop(self):
         """Loop cattura input locale (Controller 2)"""
@@ -173,10 +388,12 @@ class FCClientSlave:
                         'inputs': local_inputs,
                         'timestamp': time.time()
                     }
-                    self.client.publish(
-                        self.topics['input_to_master'],
-                        json.dumps(input_data)
-                    )
+                    if self.lockstep is not None:
+                        self.lockstep.tag_inputs(input_data)
+                    payload = json.dumps(input_data)
+                    self.client.publish(self.topics['input_to_master'], payload)
+                    if self.lockstep is not None:
+                        self.lockstep.record_bytes('inputs', len(payload))
                     
                 time.sleep(0.008)  # 120Hz
                 
@@ -211,18 +428,37 @@ class FCClientSlave:
     def start(self):
         """Avvia tutto il sistema client"""
         print("🚀 Avvio Client Slave FC26...")
+        self.start_time = time.perf_counter()
+        if self.metrics_port is not None:
+            self.profiler.enable(sample_every=self.metrics_sample_every)
+            self.profiler.serve(self.metrics_port)
         
         if not self.launch_game():
             return False
         
-        # Avvia thread input
-        input_thread = threading.Thread(target=self.input_capture_loop, daemon=True)
-        input_thread.start()
+        # Avvia thread input (gli spettatori non inviano input)
+        if self.role == 'player':
+            input_thread = threading.Thread(target=self.input_capture_loop, daemon=True)
+            input_thread.start()
+        
+        if self.lockstep is not None:
+            lockstep_thread = threading.Thread(target=self.lockstep_loop, daemon=True)
+            lockstep_thread.start()
         
         print("✅ Client pronto in attesa sincronizzazione...")
-        self.client.loop_forever()
+        try:
+            self.client.loop_forever()
+        finally:
+            self.stop()
         
         return True
+    
+    def stop(self):
+        """Avvisa il master dell'uscita e chiude la connessione"""
+        self.running = False
+        leave_msg = {'command': 'client_leave', 'session_id': self.session_id}
+        self.client.publish(self.topics['control'], json.dumps(leave_msg)).wait_for_publish(1.0)
+        self.client.disconnect()
 
 if __name__ == "__main__":
     client = FCClientSlave(broker_ip="localhost")  # Cambia con IP broker
@@ -0,0 +1,319 @@
+# fanout.py
+import json
+import threading
+import time
+from collections import deque
+from transport import InProcessTransport, encode_message, decode_message
+from profiler import get_profiler
+
+
+class ClientSession:
+    """Stato di un client collegato al master (giocatore o spettatore)"""
+
+    def __init__(self, session_id, role='player'):
+        self.session_id = session_id
+        self.role = role
+        self.state = 'syncing'  # syncing -> live -> catching_up -> live
+        self.acked_seq = {}  # corsia -> ultimo seq confermato
+        self.catchup_until = {}  # corsia -> ultimo seq già reinviato
+        self.connected_at = time.time()
+        self.last_ack = time.time()
+        self.last_seen = time.time()  # ultimo ack vero (i catch-up spostano solo last_ack)
+        self.catchups = 0
+        self.snapshots = 0
+
+    def to_dict(self):
+        return {
+            'session_id': self.session_id,
+            'role': self.role,
+            'state': self.state,
+            'acked_seq': dict(self.acked_seq),
+            'catchups': self.catchups,
+            'snapshots': self.snapshots
+        }
+
+
+class FanoutHub:
+    """Codifica ogni delta una volta sola e lo distribuisce a tutti i client
+
+    Ogni corsia ha la propria topic, il proprio seq e la propria history:
+    MQTT non garantisce l'ordine tra topic diverse.
+    """
+
+    def __init__(self, transport, stream_topics, client_topic='fc26/client/{session_id}/memory',
+                 history_size=256, max_lag=60, stall_timeout=0.5, session_timeout=10.0):
+        self.transport = transport
+        self.stream_topics = stream_topics  # corsia -> topic condivisa
+        self.client_topic = client_topic
+        self.history = {lane: deque(maxlen=history_size) for lane in stream_topics}  # (seq, payload, pagine)
+        self.seq = {lane: 0 for lane in stream_topics}
+        self.max_lag = max_lag  # seq di ritardo oltre cui si interviene
+        self.stall_timeout = stall_timeout  # secondi senza ack prima del catch-up
+        self.session_timeout = session_timeout  # secondi senza ack prima di dimenticare il client
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.compression_level = 0  # regolato dal controllo di banda
+        self.profiler = get_profiler()
+        self.last_encode_ms = 0.0
+        self.inflight = deque()  # esiti di publish non ancora trasmessi
+
+        self.stats = {
+            'deltas_encoded': 0,
+            'bytes_encoded': 0,
+            'encode_ms': 0.0,
+            'catchup_messages': 0,
+            'catchup_bytes': 0,
+            'client_snapshots': 0,
+            'sessions_expired': 0
+        }
+
+    def topic_for(self, session_id):
+        return self.client_topic.format(session_id=session_id)
+
+    def register_client(self, session_id, role='player'):
+        """Registra (o ri-registra) un client; solo lui riceverà lo snapshot"""
+        with self.lock:
+            session = ClientSession(session_id, role)
+            session.acked_seq = dict(self.seq)
+            session.catchup_until = dict(self.seq)
+            self.sessions[session_id] = session
+        return session
+
+    def remove_client(self, session_id):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+    def ack(self, session_id, seqs):
+        """Aggiorna i seq confermati da un client ({corsia: seq})"""
+        session = self.sessions.get(session_id)
+        if session is None:
+            return
+        for lane, seq in seqs.items():
+            if seq > session.acked_seq.get(lane, 0):
+                session.acked_seq[lane] = seq
+        session.last_ack = session.last_seen = time.time()
+        if session.state == 'catching_up' and all(
+            self.seq[lane] - session.acked_seq.get(lane, 0) <= self.max_lag for lane in self.seq
+        ):
+            session.state = 'live'
+
+    def snapshot_started(self, session):
+        """Segna l'inizio di uno snapshot dedicato, ritorna i seq di base per corsia"""
+        with self.lock:
+            base_seq = dict(self.seq)
+        session.acked_seq = dict(base_seq)
+        session.catchup_until = dict(base_seq)
+        session.last_ack = session.last_seen = time.time()
+        session.snapshots += 1
+        session.state = 'live'
+        self.stats['client_snapshots'] += 1
+        return base_seq
+
+    def publish_delta(self, delta_data, lane='bulk'):
+        """Assegna il seq, codifica una volta e pubblica sulla topic della corsia"""
+        started = time.perf_counter()
+        with self.lock:
+            self.seq[lane] += 1
+            delta_data['lane'] = lane
+            delta_data['seq'] = self.seq[lane]
+            with self.profiler.stage('encode'):
+                payload = encode_message(delta_data, self.compression_level)
+            pages = list(delta_data.get('changes', {}))
+            self.history[lane].append((self.seq[lane], payload, pages))
+
+        self.stats['deltas_encoded'] += 1
+        self.stats['bytes_encoded'] += len(payload)
+        self.last_encode_ms = (time.perf_counter() - started) * 1000
+        self.stats['encode_ms'] += self.last_encode_ms
+
+        with self.profiler.stage('publish'):
+            info = self.transport.publish(self.stream_topics[lane], payload)
+        self.profiler.count('deltas_published')
+        self.profiler.count('bytes_published', len(payload))
+        if info is not None and hasattr(info, 'is_published'):
+            self.inflight.append(info)
+        return payload
+
+    def queue_depth(self):
+        """Messaggi in attesa nel trasporto (coda paho o link emulato)"""
+        if hasattr(self.transport, 'queue_depth'):
+            return self.transport.queue_depth()
+        while self.inflight and self.inflight[0].is_published():
+            self.inflight.popleft()
+        return len(self.inflight)
+
+    def expire_sessions(self):
+        """Rimuove i client che non confermano da session_timeout, ritorna i loro id
+
+        Copre i client usciti senza client_leave: altrimenti riceverebbero
+        catch-up e snapshot per sempre.
+        """
+        now = time.time()
+        with self.lock:
+            expired = [
+                session_id for session_id, session in self.sessions.items()
+                if session.state != 'syncing' and now - session.last_seen > self.session_timeout
+            ]
+            for session_id in expired:
+                del self.sessions[session_id]
+        self.stats['sessions_expired'] += len(expired)
+        return expired
+
+    def check_lagging(self):
+        """Recupera i client in ritardo, ritorna quelli che richiedono uno snapshot"""
+        needs_snapshot = []
+        now = time.time()
+
+        with self.lock:
+            current = dict(self.seq)
+            history = {lane: list(entries) for lane, entries in self.history.items()}
+            sessions = list(self.sessions.values())
+
+        for session in sessions:
+            if session.state == 'syncing':
+                continue
+            lags = {lane: current[lane] - session.acked_seq.get(lane, 0) for lane in current}
+            stalled = now - session.last_ack > self.stall_timeout
+            lagging = [
+                lane for lane, lag in lags.items()
+                if lag > self.max_lag or (lag > 0 and stalled)
+            ]
+            if not lagging:
+                continue
+
+            # Troppo indietro: la history non basta più
+            if any(
+                history[lane] and session.acked_seq.get(lane, 0) + 1 < history[lane][0][0]
+                for lane in lagging
+            ):
+                session.state = 'syncing'
+                needs_snapshot.append(session)
+                continue
+
+            # Catch-up dedicato con i payload già codificati
+            session.state = 'catching_up'
+            topic = self.topic_for(session.session_id)
+            for lane in lagging:
+                start_seq = max(session.acked_seq.get(lane, 0), session.catchup_until.get(lane, 0))
+                for seq, payload, _ in history[lane]:
+                    if seq > start_seq:
+                        self.transport.publish(topic, payload)
+                        self.stats['catchup_messages'] += 1
+                        self.stats['catchup_bytes'] += len(payload)
+                session.catchup_until[lane] = current[lane]
+            session.last_ack = now
+            session.catchups += 1
+
+        return needs_snapshot
+
+    def pages_between(self, lane, from_seq, to_seq):
+        """Pagine toccate dai delta [from_seq, to_seq], None se la history non li copre"""
+        with self.lock:
+            entries = list(self.history[lane])
+        if not entries or from_seq < entries[0][0]:
+            return None
+
+        pages = set()
+        for seq, _, seq_pages in entries:
+            if from_seq <= seq <= to_seq:
+                pages.update(seq_pages)
+        return pages
+
+    def get_stats(self):
+        stats = self.stats.copy()
+        stats['seq'] = dict(self.seq)
+        stats['clients'] = [s.to_dict() for s in self.sessions.values()]
+        return stats
+
+
+class SimulatedClient:
+    """Client simulato che decodifica il flusso e conferma i seq"""
+
+    def __init__(self, hub, transport, session_id, ack_every=4, drop_every=0):
+        self.hub = hub
+        self.session_id = session_id
+        self.ack_every = ack_every
+        self.drop_every = drop_every  # perde un messaggio ogni N (0 = mai)
+        self.received = 0
+        self.applied = 0
+        for topic in hub.stream_topics.values():
+            transport.subscribe(topic, self.on_message)
+        transport.subscribe(hub.topic_for(session_id), self.on_message)
+        self.last_seq = hub.snapshot_started(hub.register_client(session_id, role='observer'))
+
+    def on_message(self, topic, payload):
+        self.received += 1
+        if self.drop_every and self.received % self.drop_every == 0 and topic != self.hub.topic_for(self.session_id):
+            return
+        delta = decode_message(payload)
+        lane, seq = delta['lane'], delta['seq']
+        if seq != self.last_seq[lane] + 1:
+            return  # fuori ordine: aspetta il catch-up
+        self.last_seq[lane] = seq
+        self.applied += 1
+        if seq % self.ack_every == 0:
+            self.hub.ack(self.session_id, self.last_seq)
+
+
+def benchmark_fanout(client_counts=(1, 4, 16), ticks=300, pages_per_tick=32, changes_per_page=24):
+    """Misura encode-once contro encode-per-client su trasporto in-process"""
+
+    delta_template = {
+        'type': 'delta_changes',
+        'changes': {
+            hex(0x140000000 + p * 4096): {
+                'changes': [(i * 7, i & 0xFF) for i in range(changes_per_page)],
+                'full_size': 4096
+            }
+            for p in range(pages_per_tick)
+        }
+    }
+
+    results = []
+    for count in client_counts:
+        transport = InProcessTransport()
+        hub = FanoutHub(
+            transport,
+            {'bulk': 'fc26/master/memory_delta', 'critical': 'fc26/master/memory_critical'},
+            max_lag=8,
+            stall_timeout=60.0
+        )
+        clients = [
+            SimulatedClient(hub, transport, f"sim{i}", drop_every=(50 if i % 4 == 3 else 0))
+            for i in range(count)
+        ]
+
+        started = time.perf_counter()
+        for tick in range(ticks):
+            hub.publish_delta(dict(delta_template), lane='bulk')
+            if tick % 10 == 0:
+                hub.check_lagging()
+        hub.check_lagging()
+        elapsed = time.perf_counter() - started
+
+        # Confronto: stessa codifica ripetuta per ogni client
+        per_client_started = time.perf_counter()
+        for _ in range(ticks):
+            for _ in range(count):
+                json.dumps(delta_template).encode()
+        per_client_encode = time.perf_counter() - per_client_started
+
+        results.append({
+            'clients': count,
+            'tick_ms': elapsed / ticks * 1000,
+            'encode_ms': hub.stats['encode_ms'] / ticks,
+            'per_client_encode_ms': per_client_encode / ticks * 1000,
+            'bytes_delivered': transport.bytes_delivered,
+            'catchup_messages': hub.stats['catchup_messages'],
+            'in_sync': sum(1 for c in clients if c.last_seq == hub.seq)
+        })
+
+    return results
+
+
+if __name__ == "__main__":
+    for result in benchmark_fanout():
+        print(f"📊 {result['clients']:2d} client: tick {result['tick_ms']:.3f} ms, "
+              f"encode {result['encode_ms']:.3f} ms (per-client {result['per_client_encode_ms']:.3f} ms), "
+              f"{result['bytes_delivered'] / 1024:.0f} KB consegnati, "
+              f"catch-up {result['catchup_messages']}, sincronizzati {result['in_sync']}/{result['clients']}")
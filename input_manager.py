@@ -1,10 +1,10 @@
 # input_manager.py
-import pygame
-import ctypes
-from ctypes import wintypes
 
 class InputManager:
     def __init__(self):
+        # pygame si importa solo quando serve davvero un controller
+        import pygame
+        self.pygame = pygame
         pygame.init()
         pygame.joystick.init()
         self.joysticks = []
@@ -20,7 +20,7 @@ class InputManager:
         if controller_id >= len(self.joysticks):
             return None
             
-        pygame.event.pump()
+        self.pygame.event.pump()
         joystick = self.joysticks[controller_id]
         
         return {
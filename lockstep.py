@@ -0,0 +1,151 @@
+# lockstep.py
+import time
+import zlib
+from array import array
+from collections import deque
+
+
+class LockstepSession:
+    """Modalità lockstep: si scambiano solo input per frame e checksum periodici
+
+    Entrambi i processi partono identici e ricevono gli stessi input, quindi
+    lo stato resta uguale; la memoria viaggia solo quando i checksum delle
+    regioni critiche non coincidono per confirm_checksums confronti di fila
+    con la pagina locale ferma (il frame del client è allineato solo a grandi
+    linee, un singolo confronto può cadere su una pagina in movimento).
+    """
+
+    def __init__(self, sync_engine, checksum_every=30, input_history=600,
+                 confirm_checksums=2, is_master=False):
+        self.engine = sync_engine
+        self.checksum_every = checksum_every  # frame tra due checksum
+        self.confirm_checksums = confirm_checksums  # confronti divergenti di fila prima del desync
+        self.is_master = is_master  # solo il master stima i byte della modalità continua
+        self.frame = 0
+        self.started = time.time()
+
+        self.remote_inputs = {}
+        self.remote_frames = deque(maxlen=input_history)
+        self.pending_checksums = deque()  # checksum del master non ancora confrontati
+        self.suspect_pages = {}  # pagina -> (confronti divergenti consecutivi, crc locale)
+        self.remote_desyncs = {}  # master: desync riportati da ogni client
+
+        self.stats = {
+            'frames': 0,
+            'inputs_bytes': 0,
+            'checksums_sent': 0,
+            'checksums_compared': 0,
+            'checksum_bytes': 0,
+            'desyncs': 0,
+            'desynced_pages': 0,
+            'transient_mismatches': 0,
+            'repair_bytes': 0,
+            'continuous_bytes_estimate': 0
+        }
+
+    def next_frame(self):
+        """Avanza il frame locale, ritorna True se è un frame di checksum"""
+        self.frame += 1
+        self.stats['frames'] += 1
+        return self.frame % self.checksum_every == 0
+
+    def tag_inputs(self, input_data):
+        """Aggiunge il frame corrente a un messaggio di input"""
+        input_data['frame'] = self.frame
+        return input_data
+
+    def record_remote_inputs(self, input_data):
+        """Memorizza gli input remoti per frame (gli ultimi input_history)"""
+        frame = input_data.get('frame')
+        if frame is None:
+            return
+        if len(self.remote_frames) == self.remote_frames.maxlen:
+            self.remote_inputs.pop(self.remote_frames[0], None)
+        self.remote_frames.append(frame)
+        self.remote_inputs[frame] = input_data.get('inputs')
+
+    def inputs_for_frame(self, frame):
+        return self.remote_inputs.get(frame)
+
+    def page_checksums(self, page_addrs):
+        """Checksum per pagina ricavato dagli hash per blocco del motore"""
+        return {
+            hex(page_addr): zlib.crc32(array('I', hashes).tobytes())
+            for page_addr, hashes in self.engine.hash_pages(page_addrs).items()
+        }
+
+    def build_checksum(self, page_addrs):
+        """Messaggio di checksum delle regioni critiche per il frame corrente"""
+        self.stats['checksums_sent'] += 1
+        return {
+            'type': 'state_checksum',
+            'frame': self.frame,
+            'timestamp': time.time(),
+            'hashes': self.page_checksums(page_addrs)
+        }
+
+    def queue_remote_checksum(self, checksum_data):
+        self.pending_checksums.append(checksum_data)
+
+    def check_pending(self):
+        """Confronta i checksum remoti già raggiunti, ritorna le pagine divergenti confermate"""
+        mismatched = set()
+        while self.pending_checksums and self.pending_checksums[0]['frame'] <= self.frame:
+            checksum_data = self.pending_checksums.popleft()
+            remote = checksum_data['hashes']
+            local = self.page_checksums([int(page_addr_hex, 16) for page_addr_hex in remote])
+            pages = {
+                int(page_addr_hex, 16) for page_addr_hex, crc in remote.items()
+                if local.get(page_addr_hex) != crc
+            }
+            self.stats['checksums_compared'] += 1
+
+            # Una pagina tornata uguale, o cambiata in locale dal confronto
+            # precedente, era solo in movimento: niente riparazione
+            suspects = {}
+            for page_addr in pages:
+                page_addr_hex = hex(page_addr)
+                count, previous_crc = self.suspect_pages.get(page_addr, (0, None))
+                count = count + 1 if previous_crc == local.get(page_addr_hex) else 1
+                suspects[page_addr] = (count, local.get(page_addr_hex))
+            self.suspect_pages = suspects
+            confirmed = {
+                page_addr for page_addr, (count, _) in self.suspect_pages.items()
+                if count >= self.confirm_checksums
+            }
+            self.stats['transient_mismatches'] += len(pages - confirmed)
+            if confirmed:
+                for page_addr in confirmed:
+                    del self.suspect_pages[page_addr]
+                self.stats['desyncs'] += 1
+                self.stats['desynced_pages'] += len(confirmed)
+                print(f"⚠️ Desync al frame {checksum_data['frame']}: {len(confirmed)} pagine divergenti")
+            mismatched.update(confirmed)
+        return mismatched
+
+    def record_remote_desyncs(self, session_id, desyncs, pages):
+        """Master: registra i desync che un client riporta nella richiesta di riparazione"""
+        self.remote_desyncs[session_id] = max(self.remote_desyncs.get(session_id, 0), desyncs)
+        self.stats['desynced_pages'] += pages
+
+    def record_bytes(self, kind, size):
+        """Conta i byte inviati per tipo ('inputs', 'checksum' o 'repair')"""
+        self.stats[f"{kind}_bytes"] += size
+
+    def record_continuous_estimate(self, delta_bytes):
+        """Byte sul filo (payload codificato) che la modalità continua avrebbe inviato"""
+        self.stats['continuous_bytes_estimate'] += delta_bytes
+
+    def get_stats(self):
+        stats = self.stats.copy()
+        elapsed = max(time.time() - self.started, 1e-6)
+        sent = stats['inputs_bytes'] + stats['checksum_bytes'] + stats['repair_bytes']
+        stats['bytes_sent'] = sent
+        if self.is_master:
+            # Il client non vede i delta che la modalità continua avrebbe inviato
+            stats['bytes_saved'] = stats['continuous_bytes_estimate'] - sent
+            stats['desyncs'] += sum(self.remote_desyncs.values())
+        else:
+            del stats['continuous_bytes_estimate']
+        stats['desyncs_per_minute'] = stats['desyncs'] / elapsed * 60
+        return stats
@@ -0,0 +1,264 @@
+# memory_backend.py
+import ctypes
+import os
+import sys
+import time
+
+
+class ProcessMemoryBackend:
+    """Interfaccia comune per l'accesso alla memoria del processo di gioco"""
+
+    def __init__(self, process_id):
+        self.process_id = process_id
+        self.read_chunk_size = None  # massimo byte per lettura di pagine contigue
+
+    def read_bytes(self, address, size):
+        raise NotImplementedError
+
+    def write_bytes(self, address, data):
+        raise NotImplementedError
+
+    def read_many(self, addresses, size, buffer=None):
+        """Legge più blocchi della stessa dimensione (None se illeggibile)"""
+        results = []
+        for address in addresses:
+            try:
+                results.append(self.read_bytes(address, size))
+            except Exception:
+                results.append(None)
+        return results
+
+    def write_many(self, writes):
+        """Scrive una lista di (indirizzo, dati), ritorna quante scritture riuscite"""
+        written = 0
+        for address, data in writes:
+            try:
+                self.write_bytes(address, data)
+                written += 1
+            except Exception:
+                continue
+        return written
+
+    def close(self):
+        pass
+
+
+class PymemBackend(ProcessMemoryBackend):
+    """Backend basato su pymem (una ReadProcessMemory per pagina)"""
+
+    def __init__(self, process_handler):
+        super().__init__(process_handler.process_id)
+        self.pm = process_handler
+
+    def read_bytes(self, address, size):
+        return self.pm.read_bytes(address, size)
+
+    def write_bytes(self, address, data):
+        self.pm.write_bytes(address, data, len(data))
+
+    def read_many(self, addresses, size, buffer=None):
+        """Unisce le pagine contigue in letture da read_chunk_size byte"""
+        if not self.read_chunk_size or self.read_chunk_size <= size:
+            return super().read_many(addresses, size, buffer)
+
+        max_run = self.read_chunk_size // size
+        results = [None] * len(addresses)
+        i = 0
+        while i < len(addresses):
+            # Estendi la corsa finché le pagine sono adiacenti
+            j = i + 1
+            while (j < len(addresses) and j - i < max_run
+                   and addresses[j] == addresses[j - 1] + size):
+                j += 1
+
+            try:
+                data = self.read_bytes(addresses[i], (j - i) * size)
+                for k in range(i, j):
+                    offset = (k - i) * size
+                    results[k] = data[offset:offset + size]
+            except Exception:
+                # Un buco nella corsa: ripiega sulla lettura pagina per pagina
+                results[i:j] = super().read_many(addresses[i:j], size)
+            i = j
+
+        return results
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+
+class LinuxVMBackend(ProcessMemoryBackend):
+    """Backend Linux con process_vm_readv/process_vm_writev vettoriali"""
+
+    # Limite kernel di iovec per singola syscall (UIO_MAXIOV)
+    IOV_MAX = 1024
+
+    def __init__(self, process_id):
+        super().__init__(process_id)
+        libc = ctypes.CDLL(None, use_errno=True)
+        argtypes = [
+            ctypes.c_int,
+            ctypes.POINTER(_IOVec), ctypes.c_ulong,
+            ctypes.POINTER(_IOVec), ctypes.c_ulong,
+            ctypes.c_ulong,
+        ]
+        self._readv = libc.process_vm_readv
+        self._readv.argtypes = argtypes
+        self._readv.restype = ctypes.c_ssize_t
+        self._writev = libc.process_vm_writev
+        self._writev.argtypes = argtypes
+        self._writev.restype = ctypes.c_ssize_t
+
+    @staticmethod
+    def is_supported():
+        """Verifica se la piattaforma espone process_vm_readv"""
+        if not sys.platform.startswith('linux'):
+            return False
+        try:
+            return hasattr(ctypes.CDLL(None), 'process_vm_readv')
+        except OSError:
+            return False
+
+    def _raise_errno(self, address):
+        err = ctypes.get_errno()
+        raise OSError(err, f"{os.strerror(err)} (0x{address:X})")
+
+    def read_bytes(self, address, size):
+        buffer = ctypes.create_string_buffer(size)
+        local = _IOVec(ctypes.cast(buffer, ctypes.c_void_p), size)
+        remote = _IOVec(address, size)
+        n = self._readv(self.process_id, ctypes.byref(local), 1, ctypes.byref(remote), 1, 0)
+        if n != size:
+            self._raise_errno(address)
+        return buffer.raw
+
+    def write_bytes(self, address, data):
+        buffer = ctypes.create_string_buffer(bytes(data), len(data))
+        local = _IOVec(ctypes.cast(buffer, ctypes.c_void_p), len(data))
+        remote = _IOVec(address, len(data))
+        n = self._writev(self.process_id, ctypes.byref(local), 1, ctypes.byref(remote), 1, 0)
+        if n != len(data):
+            self._raise_errno(address)
+
+    def read_many(self, addresses, size, buffer=None):
+        """Legge pagine sparse con una syscall ogni IOV_MAX pagine nel buffer fornito"""
+        count = len(addresses)
+        if buffer is None or len(buffer) < count * size:
+            buffer = bytearray(count * size)
+        c_buffer = (ctypes.c_char * len(buffer)).from_buffer(buffer)
+        base = ctypes.addressof(c_buffer)
+        results = [None] * count
+
+        start = 0
+        while start < count:
+            batch = min(self.IOV_MAX, count - start)
+            local = (_IOVec * batch)()
+            remote = (_IOVec * batch)()
+            for i in range(batch):
+                local[i].iov_base = base + (start + i) * size
+                local[i].iov_len = size
+                remote[i].iov_base = addresses[start + i]
+                remote[i].iov_len = size
+
+            n = self._readv(self.process_id, local, batch, remote, batch, 0)
+            done = max(n, 0) // size
+            for i in range(done):
+                offset = (start + i) * size
+                results[start + i] = bytes(buffer[offset:offset + size])
+
+            # Il kernel si ferma alla prima pagina illeggibile: saltala e riprendi
+            start += done if done == batch else done + 1
+
+        del c_buffer
+        return results
+
+    def write_many(self, writes):
+        """Scrive blocchi sparsi con una syscall ogni IOV_MAX blocchi"""
+        written = 0
+        start = 0
+        while start < len(writes):
+            batch = writes[start:start + self.IOV_MAX]
+            buffers = [ctypes.create_string_buffer(bytes(data), len(data)) for _, data in batch]
+            local = (_IOVec * len(batch))()
+            remote = (_IOVec * len(batch))()
+            for i, (address, data) in enumerate(batch):
+                local[i].iov_base = ctypes.cast(buffers[i], ctypes.c_void_p)
+                local[i].iov_len = len(data)
+                remote[i].iov_base = address
+                remote[i].iov_len = len(data)
+
+            n = max(self._writev(self.process_id, local, len(batch), remote, len(batch), 0), 0)
+
+            # Conta i blocchi completati, salta quello che ha fallito
+            done = 0
+            for _, data in batch:
+                if n < len(data):
+                    break
+                n -= len(data)
+                done += 1
+            written += done
+            start += done if done == len(batch) else done + 1
+
+        return written
+
+
+def create_backend(process_handler):
+    """Sceglie il backend più veloce disponibile per il processo"""
+    if LinuxVMBackend.is_supported():
+        try:
+            return LinuxVMBackend(process_handler.process_id)
+        except (OSError, AttributeError):
+            pass
+    return PymemBackend(process_handler)
+
+
+def benchmark_backend(backend, addresses, size=4096, rounds=20):
+    """Confronta letture pagina per pagina con letture vettoriali"""
+    buffer = bytearray(len(addresses) * size)
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for address in addresses:
+            backend.read_bytes(address, size)
+    per_page = (time.perf_counter() - start) / rounds
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        backend.read_many(addresses, size, buffer)
+    batched = (time.perf_counter() - start) / rounds
+
+    return {
+        'pages': len(addresses),
+        'per_page_ms': per_page * 1000,
+        'batched_ms': batched * 1000,
+        'speedup': per_page / batched if batched else 0.0
+    }
+
+
+if __name__ == "__main__":
+    import subprocess
+
+    # Processo figlio locale che espone un buffer di pagine da leggere
+    child_code = (
+        "import ctypes, sys\n"
+        "buf = ctypes.create_string_buffer(4096 * 2048)\n"
+        "print(ctypes.addressof(buf), flush=True)\n"
+        "sys.stdin.read()\n"
+    )
+    child = subprocess.Popen(
+        [sys.executable, '-c', child_code],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+    )
+    try:
+        base = int(child.stdout.readline())
+        # Pagine sparse: una ogni due
+        addresses = [base + i * 4096 for i in range(0, 2048, 2)]
+        backend = LinuxVMBackend(child.pid)
+        for pages in (16, 256, 1024):
+            result = benchmark_backend(backend, addresses[:pages])
+            print(f"📊 {result['pages']:5d} pagine: per-pagina {result['per_page_ms']:.3f} ms, "
+                  f"vettoriale {result['batched_ms']:.3f} ms (x{result['speedup']:.1f})")
+    finally:
+        child.stdin.close()
+        child.wait()
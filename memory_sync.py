@@ -1,58 +1,96 @@
 # memory_sync.py
-import pymem
 import json
 import time
 import threading
 from collections import defaultdict
 import struct
-import psutil
+from memory_backend import create_backend
+from region_map import get_region_map
+from block_diff import diff_blocks, changed_offsets, encode_blocks, apply_blocks, block_hashes
+from profiler import get_profiler
+from region_profile import VolatilePageProfiler, load_region_profile, save_region_layout, load_region_layout
 
 class MemorySyncEngine:
     """Motore di sincronizzazione memoria per FC24 Career Coop"""
     
     def __init__(self, process_handler, role="master"):
         self.pm = process_handler
+        self.backend = create_backend(process_handler)
+        self.region_map = get_region_map(process_handler.process_id)
         self.role = role
-        self.memory_regions = []
+        self.memory_regions = []    # corsia bulk
+        self.critical_regions = []  # corsia prioritaria (firme critiche)
         self.memory_snapshot = {}
+        self.page_versions = {}  # pagina -> versione (incrementata ad ogni delta)
+        self.state_lock = threading.Lock()  # snapshot e versioni cambiano insieme
+        self.repair_candidates = set()  # pagine con versioni saltate da riparare
+        self.complete_versions = {}  # pagina -> ultima versione ricevuta per intero prima del salto
         self.dirty_pages = set()
-        self.page_size = 4096
+        self.page_size = 4096  # pagina OS: unità di indirizzamento e lettura
+        self.block_size = 64  # granularità di diff, hash e scrittura
+        self.game_modules = {}  # nome -> (base, dimensione)
+        
+        # Profilo regioni (pagine rumorose escluse, offset volatili mascherati)
+        self.profiler = None
+        self.stage_profiler = get_profiler()  # tempi per fase (read, diff, apply)
+        self.excluded_pages = set()
+        self.masked_offsets = {}
+        self.region_profile = None  # esito dell'ultimo profilo applicato (banda per pagina)
         
         # Statistiche e monitoring
         self.sync_stats = {
             'total_changes': 0,
             'bytes_sent': 0,
             'sync_count': 0,
-            'last_sync': 0
+            'last_sync': 0,
+            'stale_pages_skipped': 0
         }
         
         # Configurazione
         self.sync_interval = 0.016  # 60fps
-        self.max_page_size = 1024 * 1024  # 1MB max per pagina
+        self.bulk_batch_pages = 256  # pagine per lotto nella corsia bulk
+        self._bulk_cursor = 0
+        self.lane_stats = {}
+        self.read_chunk_size = 1024 * 1024  # pagine contigue lette in blocchi fino a 1MB
         self.compression_enabled = True
         
+        # Buffer riutilizzato dalle letture vettoriali
+        self._read_buffer = bytearray()
+        self._profile_tick = {}
+        self._profile_bytes = {}
+        self._profile_scanned = []
+        
+    def find_game_modules(self):
+        """Aggiorna game_modules con i moduli di gioco caricati, ritorna i moduli trovati"""
+        target_modules = ['fc26', 'fc24', 'game', 'main', 'engine']
+        found_modules = []
+        for module in self.pm.list_modules():
+            module_name = module.name.lower()
+            if any(target in module_name for target in target_modules):
+                found_modules.append(module)
+                self.game_modules[module.name] = (module.lpBaseOfDll, module.SizeOfImage)
+        return found_modules
+    
     def identify_game_memory(self):
         """Identifica le regioni di memoria critiche del gioco"""
         print("🔍 Scansione memoria gioco...")
         
         try:
             # Cerca moduli principali del gioco
-            target_modules = ['fc24', 'game', 'main', 'engine']
-            found_modules = []
+            found_modules = self.find_game_modules()
+            known_pages = set(self.memory_regions)
             
-            for module in self.pm.list_modules():
-                module_name = module.name.lower()
-                if any(target in module_name for target in target_modules):
-                    print(f"📦 Trovato modulo: {module.name} (0x{module.lpBaseOfDll:X})")
-                    found_modules.append(module)
-                    
-                    # Aggiungi tutte le pagine del modulo
-                    base_addr = module.lpBaseOfDll
-                    size = module.SizeOfImage
-                    
-                    for page_start in range(base_addr, base_addr + size, self.page_size):
-                        if page_start not in self.memory_regions:
-                            self.memory_regions.append(page_start)
+            for module in found_modules:
+                print(f"📦 Trovato modulo: {module.name} (0x{module.lpBaseOfDll:X})")
+                
+                # Aggiungi tutte le pagine del modulo
+                base_addr = module.lpBaseOfDll
+                size = module.SizeOfImage
+                
+                for page_start in range(base_addr, base_addr + size, self.page_size):
+                    if page_start not in known_pages:
+                        known_pages.add(page_start)
+                        self.memory_regions.append(page_start)
             
             # Se non trova moduli specifici, usa euristica
             if not found_modules:
@@ -64,30 +102,44 @@ class MemorySyncEngine:
             print(f"❌ Errore scansione memoria: {e}")
             self._heuristic_memory_scan()
     
+    def save_layout(self, path, critical_addresses=None):
+        """Salva pagine e indirizzi critici relativi ai moduli per gli avvii successivi"""
+        pages = self.critical_regions + self.memory_regions
+        return save_region_layout(path, self.game_modules, pages, critical_addresses, self.page_size)
+    
+    def load_layout(self, path):
+        """Riusa un layout salvato se i moduli coincidono, ritorna gli indirizzi critici o None"""
+        try:
+            self.find_game_modules()
+            layout = load_region_layout(path, self.game_modules, self.page_size)
+        except Exception as e:
+            print(f"⚠️ Layout in cache non utilizzabile: {e}")
+            return None
+        if layout is None:
+            return None
+        
+        self.memory_regions = layout['pages']
+        print(f"♻️ Layout regioni dalla cache: {len(self.memory_regions)} pagine")
+        return layout['critical_addresses']
+    
     def _heuristic_memory_scan(self):
         """Scansione euristica delle regioni di memoria"""
         print("🔄 Scansione euristica memoria...")
         
         try:
-            process = psutil.Process(self.pm.process_id)
-            memory_maps = process.memory_maps()
+            self.region_map.refresh(force=True)
+            known_pages = set(self.memory_regions)
             
-            for memory_map in memory_maps:
+            for start_addr, end_addr, perms, path in self.region_map.regions():
                 # Filtra regioni interessanti (eseguibili, scrivibili)
-                perms = memory_map.perms
-                path = memory_map.path.lower()
-                
                 # Prendi regioni RW o RWX che non siano stack/heap generici
-                if ('r' in perms and 'w' in perms) and ('stack' not in path):
-                    start_addr = int(memory_map.addr.split('-')[0], 16)
-                    end_addr = int(memory_map.addr.split('-')[1], 16)
-                    size = end_addr - start_addr
-                    
-                    # Aggiungi pagine di dimensioni ragionevoli
-                    if size <= self.max_page_size:
-                        for page in range(start_addr, end_addr, self.page_size):
-                            if page not in self.memory_regions:
-                                self.memory_regions.append(page)
+                if ('r' in perms and 'w' in perms) and ('stack' not in path.lower()):
+                    # Le regioni grandi non si scartano: il backend le legge a
+                    # blocchi di read_chunk_size
+                    for page in range(start_addr, end_addr, self.page_size):
+                        if page not in known_pages:
+                            known_pages.add(page)
+                            self.memory_regions.append(page)
             
             print(f"📍 Trovate {len(self.memory_regions)} pagine con euristica")
             
@@ -99,27 +151,78 @@ class MemorySyncEngine:
         print("📸 Creazione snapshot iniziale...")
         
         successful_pages = 0
-        for page_addr in self.memory_regions:
-            try:
-                data = self.pm.read_bytes(page_addr, self.page_size)
-                self.memory_snapshot[page_addr] = data
-                successful_pages += 1
-            except Exception as e:
+        unreadable = []
+        all_pages = self.critical_regions + self.memory_regions
+        pages = self._read_pages(all_pages)
+        for page_addr, data in zip(all_pages, pages):
+            if data is None:
                 # Rimuovi pagine non leggibili
-                if page_addr in self.memory_regions:
-                    self.memory_regions.remove(page_addr)
+                unreadable.append(page_addr)
                 continue
+            self.memory_snapshot[page_addr] = data
+            successful_pages += 1
         
-        print(f"✅ Snapshot creato: {successful_pages}/{len(self.memory_regions)} pagine")
+        if unreadable:
+            unreadable = set(unreadable)
+            self.memory_regions = [p for p in self.memory_regions if p not in unreadable]
+            self.critical_regions = [p for p in self.critical_regions if p not in unreadable]
+        
+        print(f"✅ Snapshot creato: {successful_pages}/{len(all_pages)} pagine")
         return successful_pages
     
-    def detect_memory_changes(self):
-        """Rileva cambiamenti nella memoria rispetto allo snapshot"""
+    def detect_memory_changes(self, lane=None, byte_budget=None, deadline=None):
+        """Rileva cambiamenti nella memoria rispetto allo snapshot
+        
+        lane: None (tutte le pagine), 'critical' o 'bulk'. La corsia bulk
+        riprende dal punto in cui si era fermata e si interrompe quando
+        supera byte_budget o il deadline (time.perf_counter()).
+        """
         changes = {}
+        unreadable = []
+        started = time.perf_counter()
+        self._profile_tick = {}
+        self._profile_bytes = {}
+        self._profile_scanned = []
         
-        for page_addr in self.memory_regions:
-            try:
-                current_data = self.pm.read_bytes(page_addr, self.page_size)
+        if lane == 'critical':
+            lane_bytes = self._scan_pages(self.critical_regions, changes, unreadable)
+        elif lane == 'bulk' and (byte_budget is not None or deadline is not None):
+            lane_bytes = self._scan_bulk_budgeted(changes, unreadable, byte_budget, deadline)
+        else:
+            lane_bytes = self._scan_pages(self.memory_regions, changes, unreadable)
+            if lane is None:
+                lane_bytes += self._scan_pages(self.critical_regions, changes, unreadable)
+        
+        if unreadable:
+            unreadable = set(unreadable)
+            self.memory_regions = [p for p in self.memory_regions if p not in unreadable]
+            self.critical_regions = [p for p in self.critical_regions if p not in unreadable]
+        
+        if self.profiler is not None:
+            self.profiler.record_tick(self._profile_tick, self._profile_bytes,
+                                      new_tick=(lane != 'critical'),
+                                      scanned_pages=self._profile_scanned)
+        
+        if lane is not None:
+            self.record_lane(lane, lane_bytes, time.perf_counter() - started, len(changes))
+        
+        self.sync_stats['sync_count'] += 1
+        self.sync_stats['last_sync'] = time.time()
+        
+        return changes
+    
+    def _scan_pages(self, page_addrs, changes, unreadable):
+        """Confronta un gruppo di pagine con lo snapshot, ritorna i byte di delta"""
+        delta_bytes = 0
+        pages = self._read_pages(page_addrs)
+        with self.stage_profiler.stage('diff'):
+            for page_addr, current_data in zip(page_addrs, pages):
+                if current_data is None:
+                    # Page non più accessibile, rimuovi
+                    unreadable.append(page_addr)
+                    self.memory_snapshot.pop(page_addr, None)
+                    continue
+                
                 old_data = self.memory_snapshot.get(page_addr)
                 
                 if old_data is None:
@@ -127,49 +230,138 @@ class MemorySyncEngine:
                     self.memory_snapshot[page_addr] = current_data
                     continue
                 
+                if self.profiler is not None:
+                    self._profile_scanned.append(page_addr)
+                
                 if current_data != old_data:
-                    # Calcola delta efficiente
-                    delta_changes = self._calculate_delta(old_data, current_data)
+                    # Diff a blocchi: solo i blocchi cambiati vanno sul filo
+                    block_size = self.block_size
+                    offsets = diff_blocks(old_data, current_data, block_size)
+                    
+                    masked = self.masked_offsets.get(page_addr)
+                    if self.profiler is not None:
+                        self._profile_tick[page_addr] = [
+                            i for offset in offsets
+                            for i in changed_offsets(old_data, current_data, offset, offset + block_size)
+                        ]
+                    if masked:
+                        # Scarta i blocchi in cui cambiano solo offset volatili
+                        offsets = [
+                            offset for offset in offsets
+                            if any(i not in masked for i in
+                                   changed_offsets(old_data, current_data, offset, offset + block_size))
+                        ]
+                    
+                    # Aggiorna snapshot e versione insieme (lo snapshot ai client li legge in coppia)
+                    with self.state_lock:
+                        self.memory_snapshot[page_addr] = current_data
+                        if offsets:
+                            version = self.page_versions.get(page_addr, 0) + 1
+                            self.page_versions[page_addr] = version
                     
-                    if delta_changes:
+                    if offsets:
+                        blocks = encode_blocks(current_data, offsets, block_size)
                         changes[page_addr] = {
-                            'changes': delta_changes,
+                            'blocks': blocks,
                             'full_size': len(current_data),
+                            'version': version,
                             'timestamp': time.time()
                         }
                         
-                        # Aggiorna snapshot
-                        self.memory_snapshot[page_addr] = current_data
-                        
                         # Statistiche
-                        self.sync_stats['total_changes'] += len(delta_changes)
-                        self.sync_stats['bytes_sent'] += len(delta_changes) * 2  # approx
-                        
-            except Exception as e:
-                # Page non più accessibile, rimuovi
-                if page_addr in self.memory_regions:
-                    self.memory_regions.remove(page_addr)
-                if page_addr in self.memory_snapshot:
-                    del self.memory_snapshot[page_addr]
-                continue
-        
-        self.sync_stats['sync_count'] += 1
-        self.sync_stats['last_sync'] = time.time()
+                        block_bytes = sum(len(block_hex) // 2 for _, block_hex in blocks)
+                        self.sync_stats['total_changes'] += len(blocks)
+                        self.sync_stats['bytes_sent'] += block_bytes
+                        delta_bytes += block_bytes
+                        if self.profiler is not None:
+                            self._profile_bytes[page_addr] = block_bytes
         
-        return changes
+        return delta_bytes
     
-    def _calculate_delta(self, old_data, new_data):
-        """Calcola i byte effettivamente cambiati"""
-        changes = []
-        
-        # Assicurati che le lunghezze siano uguali
-        min_len = min(len(old_data), len(new_data))
+    def _scan_bulk_budgeted(self, changes, unreadable, byte_budget, deadline):
+        """Scansiona la corsia bulk a lotti finché resta budget di byte e tempo"""
+        delta_bytes = 0
+        scanned = 0
+        total = len(self.memory_regions)
         
-        for i in range(min_len):
-            if old_data[i] != new_data[i]:
-                changes.append((i, new_data[i]))
+        while scanned < total:
+            if self._bulk_cursor >= total:
+                self._bulk_cursor = 0
+            batch = self.memory_regions[self._bulk_cursor:self._bulk_cursor + self.bulk_batch_pages]
+            batch = batch[:total - scanned]
+            
+            delta_bytes += self._scan_pages(batch, changes, unreadable)
+            self._bulk_cursor += len(batch)
+            scanned += len(batch)
+            
+            if byte_budget is not None and delta_bytes >= byte_budget:
+                break
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
         
-        return changes
+        return delta_bytes
+    
+    def _lane(self, lane):
+        return self.lane_stats.setdefault(lane, {
+            'ticks': 0,
+            'pages_changed': 0,
+            'delta_bytes': 0,
+            'wire_bytes': 0,
+            'messages': 0,
+            'scan_ms': 0.0,
+            'publish_ms': 0.0,
+            'last_latency_ms': 0.0,
+            'max_latency_ms': 0.0
+        })
+    
+    def record_lane(self, lane, delta_bytes, latency, pages_changed=0):
+        """Registra la scansione di una corsia di sincronizzazione"""
+        stats = self._lane(lane)
+        latency_ms = latency * 1000
+        stats['ticks'] += 1
+        stats['pages_changed'] += pages_changed
+        stats['delta_bytes'] += delta_bytes
+        stats['scan_ms'] += latency_ms
+        stats['last_latency_ms'] = latency_ms
+        stats['max_latency_ms'] = max(stats['max_latency_ms'], latency_ms)
+    
+    def record_lane_publish(self, lane, wire_bytes, latency):
+        """Registra l'invio di un messaggio di una corsia (dopo la scansione)"""
+        stats = self._lane(lane)
+        latency_ms = latency * 1000
+        stats['wire_bytes'] += wire_bytes
+        stats['messages'] += 1
+        stats['publish_ms'] += latency_ms
+        stats['last_latency_ms'] += latency_ms
+        stats['max_latency_ms'] = max(stats['max_latency_ms'], stats['last_latency_ms'])
+    
+    def _read_pages(self, page_addrs):
+        """Legge le pagine in blocco tramite il backend (None se illeggibili)"""
+        needed = len(page_addrs) * self.page_size
+        if len(self._read_buffer) < needed:
+            self._read_buffer = bytearray(needed)
+        # Il backend legge sempre con la dimensione di blocco configurata sul motore
+        self.backend.read_chunk_size = self.read_chunk_size
+        self.stage_profiler.count('pages_read', len(page_addrs))
+        with self.stage_profiler.stage('read'):
+            return self.backend.read_many(page_addrs, self.page_size, self._read_buffer)
+    
+    def hash_pages(self, page_addrs):
+        """Hash per blocco delle pagine lette dalla memoria viva"""
+        pages = self._read_pages(page_addrs)
+        return {
+            page_addr: block_hashes(data, self.block_size)
+            for page_addr, data in zip(page_addrs, pages)
+            if data is not None
+        }
+    
+    def divergent_pages(self, page_addrs):
+        """Pagine la cui memoria viva non coincide più con l'ultimo stato applicato"""
+        page_addrs = [page_addr for page_addr in page_addrs if page_addr in self.memory_snapshot]
+        return [
+            page_addr for page_addr, hashes in self.hash_pages(page_addrs).items()
+            if hashes != block_hashes(self.memory_snapshot[page_addr], self.block_size)
+        ]
     
     def apply_memory_changes(self, changes_data):
         """Applica cambiamenti di memoria ricevuti"""
@@ -178,12 +370,16 @@ class MemorySyncEngine:
         try:
             change_type = changes_data.get('type', 'delta_changes')
             
-            if change_type == 'full_snapshot':
-                applied_changes = self._apply_full_snapshot(changes_data)
-            elif change_type == 'delta_changes':
-                applied_changes = self._apply_delta_changes(changes_data)
-            else:
-                print(f"❌ Tipo di cambio sconosciuto: {change_type}")
+            with self.stage_profiler.stage('apply'):
+                if change_type == 'full_snapshot':
+                    applied_changes = self._apply_full_snapshot(changes_data)
+                elif change_type == 'delta_changes':
+                    applied_changes = self._apply_delta_changes(changes_data)
+                elif change_type == 'page_repair':
+                    applied_changes = self._apply_page_repair(changes_data)
+                else:
+                    print(f"❌ Tipo di cambio sconosciuto: {change_type}")
+            self.stage_profiler.count('pages_applied', applied_changes)
                 
         except Exception as e:
             print(f"❌ Errore applicazione cambiamenti: {e}")
@@ -192,27 +388,35 @@ class MemorySyncEngine:
     
     def _apply_full_snapshot(self, snapshot_data):
         """Applica uno snapshot completo"""
-        applied_pages = 0
+        writes = []
+        versions = snapshot_data.get('versions', {})
         
         for page_addr_hex, page_data_hex in snapshot_data.get('pages', {}).items():
             try:
                 page_addr = int(page_addr_hex, 16)
-                page_data = bytes.fromhex(page_data_hex)
-                
-                # Scrivi nella memoria
-                self.pm.write_bytes(page_addr, page_data, len(page_data))
-                
-                # Aggiorna snapshot locale
-                self.memory_snapshot[page_addr] = page_data
-                
-                # Aggiungi alle regioni se non presente
-                if page_addr not in self.memory_regions:
-                    self.memory_regions.append(page_addr)
-                
-                applied_pages += 1
-                
-            except Exception as e:
-                print(f"⚠️ Errore scrittura pagina {page_addr_hex}: {e}")
+                if self.page_versions.get(page_addr, 0) > versions.get(page_addr_hex, 0):
+                    # Un delta già applicato è più recente del blocco di snapshot
+                    self.sync_stats['stale_pages_skipped'] += 1
+                    continue
+                writes.append((page_addr, bytes.fromhex(page_data_hex)))
+            except ValueError as e:
+                print(f"⚠️ Errore decodifica pagina {page_addr_hex}: {e}")
+        
+        # Scrivi nella memoria con una sola chiamata vettoriale
+        applied_pages = self.backend.write_many(writes)
+        
+        known_pages = set(self.memory_regions)
+        for page_addr, page_data in writes:
+            # Aggiorna snapshot locale
+            self.memory_snapshot[page_addr] = page_data
+            self.page_versions[page_addr] = versions.get(hex(page_addr), 0)
+            self.repair_candidates.discard(page_addr)
+            self.complete_versions.pop(page_addr, None)
+            
+            # Aggiungi alle regioni se non presente
+            if page_addr not in known_pages:
+                known_pages.add(page_addr)
+                self.memory_regions.append(page_addr)
         
         print(f"✅ Snapshot applicato: {applied_pages} pagine")
         return applied_pages
@@ -221,52 +425,228 @@ class MemorySyncEngine:
         """Applica cambiamenti delta"""
         applied_changes = 0
         
+        page_changes = []
         for page_addr_hex, change_info in delta_data.get('changes', {}).items():
             try:
                 page_addr = int(page_addr_hex, 16)
-                byte_changes = change_info['changes']
+            except ValueError as e:
+                print(f"⚠️ Errore applicazione delta {page_addr_hex}: {e}")
+                continue
+            
+            version = change_info.get('version')
+            if version is not None:
+                local_version = self.page_versions.get(page_addr, 0)
+                if version <= local_version:
+                    # Delta vecchio o duplicato: la pagina è già più recente
+                    self.sync_stats['stale_pages_skipped'] += 1
+                    continue
+                if version > local_version + 1:
+                    # Versioni saltate: i byte non coperti da questo delta vanno riparati
+                    self.repair_candidates.add(page_addr)
+                    self.complete_versions.setdefault(page_addr, local_version)
+            
+            page_changes.append((page_addr, change_info))
+        
+        # Solo il formato a coppie (offset, byte) richiede di rileggere la pagina
+        legacy = [page_addr for page_addr, change_info in page_changes if 'blocks' not in change_info]
+        legacy_pages = dict(zip(legacy, self.backend.read_many(legacy, self.page_size))) if legacy else {}
+        
+        writes = []
+        new_pages = {}
+        new_versions = {}
+        for page_addr, change_info in page_changes:
+            if 'blocks' in change_info:
+                # Scrivi solo i blocchi cambiati, senza read-modify-write della pagina
+                for offset, block_hex in change_info['blocks']:
+                    writes.append((page_addr + offset, bytes.fromhex(block_hex)))
+                applied_changes += len(change_info['blocks'])
+                
+                base = self.memory_snapshot.get(page_addr)
+                if base is not None:
+                    new_pages[page_addr] = apply_blocks(base, change_info['blocks'])
+            else:
+                page_data = legacy_pages.get(page_addr)
+                if page_data is None:
+                    print(f"⚠️ Errore applicazione delta 0x{page_addr:X}: pagina illeggibile")
+                    continue
                 
-                # Leggi dati correnti
-                current_data = bytearray(
-                    self.pm.read_bytes(page_addr, change_info['full_size'])
-                )
+                current_data = bytearray(page_data[:change_info['full_size']])
                 
                 # Applica cambiamenti
-                for offset, new_byte in byte_changes:
+                for offset, new_byte in change_info['changes']:
                     if offset < len(current_data):
                         current_data[offset] = new_byte
                         applied_changes += 1
                 
-                # Scrivi dati modificati
-                self.pm.write_bytes(page_addr, bytes(current_data), len(current_data))
-                
-                # Aggiorna snapshot locale
-                self.memory_snapshot[page_addr] = bytes(current_data)
-                
-            except Exception as e:
-                print(f"⚠️ Errore applicazione delta {page_addr_hex}: {e}")
+                writes.append((page_addr, bytes(current_data)))
+                new_pages[page_addr] = bytes(current_data)
+            
+            if 'version' in change_info:
+                new_versions[page_addr] = change_info['version']
+        
+        # Scrivi dati modificati
+        self.backend.write_many(writes)
+        
+        # Aggiorna snapshot locale e versioni
+        self.memory_snapshot.update(new_pages)
+        self.page_versions.update(new_versions)
         
         return applied_changes
     
-    def optimize_memory_regions(self, critical_addresses=None):
-        """Ottimizza le regioni di memoria per sincronizzazione"""
+    def _apply_page_repair(self, repair_data):
+        """Applica pagine intere inviate dal master per riparare un buco"""
+        writes = []
+        versions = {}
+        
+        for page_addr_hex, page_info in repair_data.get('pages', {}).items():
+            page_addr = int(page_addr_hex, 16)
+            version = page_info['version']
+            if version < self.page_versions.get(page_addr, 0):
+                self.sync_stats['stale_pages_skipped'] += 1
+                continue
+            writes.append((page_addr, bytes.fromhex(page_info['data'])))
+            versions[page_addr] = version
+        
+        repaired = self.backend.write_many(writes)
+        
+        for page_addr, page_data in writes:
+            self.memory_snapshot[page_addr] = page_data
+            self.page_versions[page_addr] = versions[page_addr]
+            self.repair_candidates.discard(page_addr)
+            self.complete_versions.pop(page_addr, None)
+        
+        return repaired
+    
+    def snapshot_pages(self):
+        """Copia coerente di (pagina, dati, versione) per uno snapshot completo"""
+        with self.state_lock:
+            return [
+                (page_addr, data, self.page_versions.get(page_addr, 0))
+                for page_addr, data in self.memory_snapshot.items()
+            ]
+    
+    def known_version(self, page_addr):
+        """Versione da dichiarare in una riparazione: quella completa, non quella del salto"""
+        return self.complete_versions.get(page_addr, self.page_versions.get(page_addr, 0))
+    
+    def build_page_repair(self, page_addrs, known_versions=None):
+        """Pagine intere alla versione corrente, solo se più recenti di quelle note"""
+        known_versions = known_versions or {}
+        pages = {}
+        
+        for page_addr in page_addrs:
+            with self.state_lock:
+                data = self.memory_snapshot.get(page_addr)
+                version = self.page_versions.get(page_addr, 0)
+            if data is None:
+                continue
+            if version <= known_versions.get(page_addr, -1):
+                continue
+            pages[hex(page_addr)] = {'data': data.hex(), 'version': version}
+        
+        return pages
+    
+    def optimize_memory_regions(self, critical_addresses=None, critical_span=1):
+        """Ottimizza le regioni di memoria per sincronizzazione
+        
+        Gli indirizzi critici (lista o dict nome -> indirizzo dello scanner
+        di firme) finiscono nella corsia prioritaria, separata dalla bulk.
+        """
         if critical_addresses:
+            if isinstance(critical_addresses, dict):
+                critical_addresses = critical_addresses.values()
+            
             # Aggiungi indirizzi critici specifici
+            critical = set(self.critical_regions)
             for addr in critical_addresses:
                 page_addr = (addr // self.page_size) * self.page_size
-                if page_addr not in self.memory_regions:
-                    self.memory_regions.append(page_addr)
+                for i in range(critical_span):
+                    critical.add(page_addr + i * self.page_size)
+            self.critical_regions = sorted(critical)
         
         # Rimuovi duplicati e ordina
-        self.memory_regions = sorted(set(self.memory_regions))
+        critical = set(self.critical_regions)
+        self.memory_regions = sorted(set(self.memory_regions) - critical)
+        self._bulk_cursor = 0
         
-        print(f"🔧 Regioni ottimizzate: {len(self.memory_regions)} pagine")
+        print(f"🔧 Regioni ottimizzate: {len(self.critical_regions)} pagine critiche, "
+              f"{len(self.memory_regions)} pagine bulk")
+    
+    def start_profiling(self, noise_threshold=0.9):
+        """Avvia una sessione di calibrazione delle pagine volatili"""
+        self.profiler = VolatilePageProfiler(self.page_size, noise_threshold)
+        # Durante la calibrazione servono dati grezzi, senza maschere
+        self.masked_offsets = {}
+        print("🧪 Profilazione pagine volatili avviata...")
+    
+    def stop_profiling(self, profile_path):
+        """Termina la calibrazione e salva il profilo regioni"""
+        if self.profiler is None:
+            return None
+        profile = self.profiler.save(profile_path, self.game_modules)
+        self.profiler = None
+        return profile
+    
+    def apply_region_profile(self, profile_path, mode='exclude'):
+        """Applica un profilo regioni come maschera di esclusione o inclusione"""
+        profile = load_region_profile(profile_path, self.game_modules)
+        pages = profile['resolved_pages']
+        
+        if mode == 'include':
+            keep = {addr for addr, entry in pages.items() if entry['class'] == 'state'}
+            self.excluded_pages = set(self.memory_regions) - keep
+        else:
+            self.excluded_pages = {addr for addr, entry in pages.items() if entry['class'] == 'noise'}
+        
+        self.masked_offsets = {
+            addr: set(entry['volatile_offsets'])
+            for addr, entry in pages.items()
+            if entry.get('volatile_offsets') and addr not in self.excluded_pages
+        }
+        
+        self.memory_regions = [p for p in self.memory_regions if p not in self.excluded_pages]
+        for page_addr in self.excluded_pages:
+            self.memory_snapshot.pop(page_addr, None)
+        
+        # Banda risparmiata per pagina esclusa
+        ticks_per_second = 1.0 / self.sync_interval
+        saved = {}
+        for page_addr in self.excluded_pages:
+            entry = pages.get(page_addr)
+            if entry:
+                saved[page_addr] = entry['bytes_per_tick'] * ticks_per_second
+        
+        total_saved = sum(saved.values())
+        print(f"🧹 Profilo applicato ({mode}): {len(self.excluded_pages)} pagine escluse, "
+              f"{len(self.masked_offsets)} pagine con offset mascherati, "
+              f"~{total_saved / 1024:.1f} KB/s risparmiati")
+        
+        self.region_profile = {
+            'mode': mode,
+            'excluded_pages': len(self.excluded_pages),
+            'masked_pages': len(self.masked_offsets),
+            'bytes_per_second_saved': total_saved,
+            'saved_per_page': {hex(addr): rate for addr, rate in saved.items()}
+        }
+        return self.region_profile
     
     def get_sync_stats(self):
         """Restituisce statistiche di sincronizzazione"""
         stats = self.sync_stats.copy()
         stats['monitored_pages'] = len(self.memory_regions)
         stats['active_pages'] = len(self.memory_snapshot)
+        stats['excluded_pages'] = len(self.excluded_pages)
+        stats['critical_pages'] = len(self.critical_regions)
+        if self.region_profile is not None:
+            stats['region_profile'] = self.region_profile
+        
+        lanes = {}
+        for lane, lane_stats in self.lane_stats.items():
+            lane_stats = lane_stats.copy()
+            ticks = max(lane_stats['ticks'], 1)
+            lane_stats['avg_latency_ms'] = (lane_stats['scan_ms'] + lane_stats['publish_ms']) / ticks
+            lanes[lane] = lane_stats
+        stats['lanes'] = lanes
         
         if stats['sync_count'] > 0:
             stats['avg_changes_per_sync'] = stats['total_changes'] / stats['sync_count']
@@ -278,8 +658,16 @@ class MemorySyncEngine:
     def cleanup(self):
         """Pulizia risorse"""
         self.memory_regions.clear()
+        self.critical_regions.clear()
         self.memory_snapshot.clear()
+        self.page_versions.clear()
+        self.repair_candidates.clear()
+        self.complete_versions.clear()
+        self.lane_stats.clear()
         self.dirty_pages.clear()
+        self.excluded_pages.clear()
+        self.masked_offsets.clear()
+        self.profiler = None
 
 
 class MemorySignatureScanner:
@@ -287,6 +675,7 @@ class MemorySignatureScanner:
     
     def __init__(self, process_handler):
         self.pm = process_handler
+        self.region_map = get_region_map(process_handler.process_id)
         self.signatures = {
             'player_data': [
                 b'\x48\x8B\x05\x00\x00\x00\x00\x48\x85\xC0\x74\x00\x8B',  # Esempio
@@ -313,6 +702,23 @@ class MemorySignatureScanner:
         
         return found_addresses
     
+    def verify_addresses(self, found_addresses):
+        """Controllo rapido di indirizzi già noti: ogni firma deve trovarsi ancora lì"""
+        for sig_name, address in found_addresses.items():
+            patterns = self.signatures.get(sig_name)
+            if not patterns or address is None:
+                return False
+            try:
+                data = self.pm.read_bytes(address, max(len(pattern) for pattern in patterns))
+            except Exception:
+                return False
+            if not any(
+                all(byte == 0x00 or byte == data[j] for j, byte in enumerate(pattern))
+                for pattern in patterns
+            ):
+                return False
+        return True
+    
     def _pattern_scan(self, pattern):
         """Scansiona un pattern nella memoria"""
         try:
@@ -320,13 +726,22 @@ class MemorySignatureScanner:
             modules = self.pm.list_modules()
             
             for module in modules:
-                if any(name in module.name.lower() for name in ['fc24', 'game']):
+                if any(name in module.name.lower() for name in ['fc26', 'fc24', 'game']):
                     base_address = module.lpBaseOfDll
                     module_size = module.SizeOfImage
                     
-                    # Leggi tutto il modulo (attenzione: potrebbe essere grande)
-                    try:
-                        module_data = self.pm.read_bytes(base_address, min(module_size, 50 * 1024 * 1024))  # Max 50MB
+                    module_end = base_address + min(module_size, 50 * 1024 * 1024)  # Max 50MB
+                    
+                    # Leggi solo le regioni leggibili del modulo, saltando i buchi
+                    for start, end, perms, _ in self.region_map.regions(base_address, module_end):
+                        if 'r' not in perms:
+                            continue
+                        start = max(start, base_address)
+                        end = min(end, module_end)
+                        try:
+                            module_data = self.pm.read_bytes(start, end - start)
+                        except Exception:
+                            continue
                         
                         # Cerca pattern
                         for i in range(len(module_data) - len(pattern) + 1):
@@ -337,10 +752,7 @@ class MemorySignatureScanner:
                                     break
                             
                             if match:
-                                return base_address + i
-                                
-                    except Exception as e:
-                        continue
+                                return start + i
                         
         except Exception as e:
             print(f"❌ Errore pattern scanning: {e}")
@@ -353,8 +765,18 @@ def memory_address_to_page(address, page_size=4096):
     """Converte un indirizzo di memoria in indirizzo di pagina"""
     return (address // page_size) * page_size
 
-def validate_memory_access(process_handler, address, size=4):
+def validate_memory_access(process_handler, address, size=4, region_map=None):
     """Valida se un'area di memoria è accessibile"""
+    try:
+        # Solo un riscontro positivo nella mappa in cache evita la lettura: la
+        # mappa può non conoscere regioni appena mappate (o l'heap su Windows)
+        if region_map is None:
+            region_map = get_region_map(process_handler.process_id)
+        if region_map.is_readable(address, size):
+            return True
+    except Exception:
+        pass
+    
     try:
         # Prova a leggere un byte
         process_handler.read_bytes(address, size)
@@ -362,22 +784,13 @@ def validate_memory_access(process_handler, address, size=4):
     except:
         return False
 
-def get_memory_region_info(process_handler, address):
+def get_memory_region_info(process_handler, address, region_map=None):
     """Ottiene informazioni su una regione di memoria"""
     try:
-        process = psutil.Process(process_handler.process_id)
-        for memory_map in process.memory_maps():
-            start_addr = int(memory_map.addr.split('-')[0], 16)
-            end_addr = int(memory_map.addr.split('-')[1], 16)
-            
-            if start_addr <= address < end_addr:
-                return {
-                    'address_range': memory_map.addr,
-                    'permissions': memory_map.perms,
-                    'path': memory_map.path,
-                    'size': end_addr - start_addr
-                }
+        if region_map is None:
+            region_map = get_region_map(process_handler.process_id)
+        return region_map.lookup(address)
     except:
         pass
     
-    return None
\ No newline at end of file
+    return None
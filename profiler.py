@@ -0,0 +1,274 @@
+# profiler.py
+import json
+import threading
+import time
+import tracemalloc
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Limiti superiori (ms) degli istogrammi per fase
+STAGE_BUCKETS_MS = (0.1, 0.5, 1, 2, 5, 10, 20, 50, 100, 250)
+
+
+class _NullStage:
+    """Contesto vuoto restituito da stage() quando il profiler è spento"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler.record_stage(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class StageProfiler:
+    """Timer per fase (read, diff, encode, publish, decode, apply), contatori e tick recenti
+
+    Spento costa un attributo e un return per chiamata. sample_every > 0
+    traccia anche le allocazioni con tracemalloc, attivo solo durante un
+    tick ogni sample_every.
+    """
+
+    def __init__(self, enabled=False, history=512, sample_every=0):
+        self.enabled = enabled
+        self.sample_every = sample_every
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+        # Fase -> [chiamate, secondi totali, secondi massimi, conteggi per bucket]
+        self.stages = {}
+        self.counters = defaultdict(int)
+
+        self.ticks = deque(maxlen=history)
+        self.tick_count = 0
+        self._local = threading.local()  # tick aperto per thread (loop sync, callback MQTT)
+        self.server = None
+
+    def enable(self, sample_every=None):
+        if sample_every is not None:
+            self.sample_every = sample_every
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def stage(self, name):
+        """Context manager che misura una fase: with profiler.stage('diff'): ..."""
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def record_stage(self, name, seconds):
+        with self.lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = [0, 0.0, 0.0, [0] * (len(STAGE_BUCKETS_MS) + 1)]
+            stage[0] += 1
+            stage[1] += seconds
+            stage[2] = max(stage[2], seconds)
+            ms = seconds * 1000
+            for i, limit in enumerate(STAGE_BUCKETS_MS):
+                if ms <= limit:
+                    stage[3][i] += 1
+                    break
+            else:
+                stage[3][-1] += 1
+
+            tick = getattr(self._local, 'tick', None)
+            if tick is not None:
+                tick['stages'][name] = tick['stages'].get(name, 0.0) + ms
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] += value
+            tick = getattr(self._local, 'tick', None)
+            if tick is not None:
+                tick['counters'][name] = tick['counters'].get(name, 0) + value
+
+    def begin_tick(self, kind='sync'):
+        """Apre il record di un tick; le fasi misurate finiscono nel record"""
+        if not self.enabled:
+            return
+        self.tick_count += 1
+        sampled = (self.sample_every > 0 and self.tick_count % self.sample_every == 0
+                   and not tracemalloc.is_tracing())
+        if sampled:
+            tracemalloc.start()
+        self._local.tick = {
+            'tick': self.tick_count,
+            'kind': kind,
+            'timestamp': time.time(),
+            'started': time.perf_counter(),
+            'sampled': sampled,
+            'stages': {},
+            'counters': {}
+        }
+
+    def end_tick(self):
+        """Chiude il tick corrente e lo aggiunge al ring buffer"""
+        tick = getattr(self._local, 'tick', None)
+        if tick is None:
+            return None
+        self._local.tick = None
+
+        tick['duration_ms'] = (time.perf_counter() - tick.pop('started')) * 1000
+        if tick['sampled']:
+            # Memoria ancora allocata a fine tick e picco durante il tick
+            tick['alloc_bytes'], tick['alloc_peak_bytes'] = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        with self.lock:
+            if tick['sampled']:
+                self.counters['alloc_bytes'] += tick['alloc_bytes']
+                self.counters['sampled_ticks'] += 1
+            self.ticks.append(tick)
+        return tick
+
+    def to_dict(self):
+        """Dump JSON-serializzabile di fasi, contatori e tick recenti"""
+        with self.lock:
+            stages = {
+                name: {
+                    'count': count,
+                    'total_ms': total * 1000,
+                    'avg_ms': total * 1000 / count if count else 0.0,
+                    'max_ms': peak * 1000
+                }
+                for name, (count, total, peak, _) in self.stages.items()
+            }
+            return {
+                'enabled': self.enabled,
+                'uptime_s': time.time() - self.started,
+                'sample_every': self.sample_every,
+                'stages': stages,
+                'counters': dict(self.counters),
+                'ticks': list(self.ticks)
+            }
+
+    def metrics_text(self):
+        """Metriche in formato testo Prometheus"""
+        lines = [
+            '# HELP fc26_stage_seconds Tempo speso per fase della sincronizzazione',
+            '# TYPE fc26_stage_seconds histogram'
+        ]
+        with self.lock:
+            for name, (count, total, peak, buckets) in sorted(self.stages.items()):
+                cumulative = 0
+                for limit, hits in zip(STAGE_BUCKETS_MS, buckets):
+                    cumulative += hits
+                    lines.append(f'fc26_stage_seconds_bucket{{stage="{name}",le="{limit / 1000}"}} {cumulative}')
+                lines.append(f'fc26_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {count}')
+                lines.append(f'fc26_stage_seconds_sum{{stage="{name}"}} {total}')
+                lines.append(f'fc26_stage_seconds_count{{stage="{name}"}} {count}')
+
+            lines.append('# HELP fc26_stage_max_seconds Tempo massimo per fase')
+            lines.append('# TYPE fc26_stage_max_seconds gauge')
+            for name, (_, _, peak, _) in sorted(self.stages.items()):
+                lines.append(f'fc26_stage_max_seconds{{stage="{name}"}} {peak}')
+
+            lines.append('# HELP fc26_events_total Contatori della sincronizzazione')
+            lines.append('# TYPE fc26_events_total counter')
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'fc26_events_total{{name="{name}"}} {value}')
+
+            lines.append('# TYPE fc26_ticks_total counter')
+            lines.append(f'fc26_ticks_total {self.tick_count}')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port=9126, host='127.0.0.1'):
+        """Avvia l'endpoint HTTP locale: /metrics (Prometheus) e /stats.json"""
+        profiler = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body = profiler.metrics_text().encode()
+                    content_type = 'text/plain; version=0.0.4'
+                elif self.path in ('/stats.json', '/'):
+                    body = json.dumps(profiler.to_dict()).encode()
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print(f"📈 Metriche su http://{host}:{self.server.server_port}/metrics")
+        return self.server
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+# Profiler condiviso da motore, fan-out, master e client dello stesso processo
+_profiler = StageProfiler()
+
+
+def get_profiler():
+    return _profiler
+
+
+if __name__ == "__main__":
+    import urllib.request
+    import zlib
+
+    profiler = StageProfiler()
+    data = bytes(range(256)) * 256
+    rounds = 20000
+
+    def run():
+        started = time.perf_counter()
+        for _ in range(rounds):
+            with profiler.stage('diff'):
+                pass
+            profiler.count('pages_read', 16)
+        return (time.perf_counter() - started) / rounds * 1e9
+
+    print(f"📊 Spento: {run():.0f} ns per fase misurata")
+    profiler.enable()
+    print(f"📊 Acceso: {run():.0f} ns per fase misurata")
+
+    profiler.enable(sample_every=2)
+    for _ in range(10):
+        profiler.begin_tick()
+        with profiler.stage('encode'):
+            payload = zlib.compress(data, 6)
+        with profiler.stage('decode'):
+            zlib.decompress(payload)
+        profiler.end_tick()
+
+    profiler.serve(port=0)
+    base = f"http://127.0.0.1:{profiler.server.server_port}"
+    metrics = urllib.request.urlopen(f"{base}/metrics").read().decode()
+    print('\n'.join(line for line in metrics.splitlines() if '_count' in line or 'alloc' in line))
+    stats = json.loads(urllib.request.urlopen(f"{base}/stats.json").read())
+    print(f"📊 Ultimo tick: {stats['ticks'][-1]}")
+    profiler.shutdown()
@@ -0,0 +1,257 @@
+# rate_control.py
+import time
+from collections import deque
+from transport import LinkEmulator, encode_message, decode_message
+
+
+class AdaptiveRateController:
+    """Adatta frequenza di sync memoria, compressione e budget ai dati del link
+
+    La congestione si misura come crescita dell'RTT sopra il minimo recente
+    (ritardo di coda), non come RTT assoluto: un link lungo ma scarico non
+    è congestionato. Gli input non passano mai dal controller: resta fisso il
+    loro intervallo e si riducono solo frequenza e budget della memoria.
+    """
+
+    def __init__(self, min_interval=0.016, max_interval=0.1,
+                 min_budget=4 * 1024, max_budget=256 * 1024,
+                 min_compression=0, max_compression=9,
+                 target_delay=0.02, max_queue_depth=4, update_period=0.2,
+                 base_rtt_samples=200):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.min_budget = min_budget
+        self.max_budget = max_budget
+        self.min_compression = min_compression
+        self.max_compression = max_compression
+        self.target_delay = target_delay  # ritardo di coda tollerato sopra l'RTT di base
+        self.max_queue_depth = max_queue_depth
+        self.update_period = update_period
+
+        # Valori correnti
+        self.sync_interval = min_interval
+        self.byte_budget = max(min_budget, max_budget // 16)  # partenza prudente
+        self.compression_level = min_compression
+
+        # Misure (medie esponenziali)
+        self.rtt = None
+        self.base_rtt = None  # minimo degli ultimi base_rtt_samples campioni
+        self.rtt_samples = deque(maxlen=base_rtt_samples)
+        self.queue_depth = 0
+        self.apply_ms = 0.0
+        self.encode_ms = 0.0
+        self.last_update = 0.0
+
+        self.decisions = deque(maxlen=200)
+
+    @staticmethod
+    def _ema(current, sample, alpha=0.2):
+        return sample if current is None else current + alpha * (sample - current)
+
+    def observe_rtt(self, rtt):
+        self.rtt_samples.append(rtt)
+        self.base_rtt = min(self.rtt_samples)
+        self.rtt = self._ema(self.rtt, rtt)
+    
+    def queue_delay(self):
+        """Ritardo aggiunto dalle code: RTT medio meno RTT di base"""
+        if self.rtt is None:
+            return 0.0
+        return max(0.0, self.rtt - self.base_rtt)
+
+    def observe_queue_depth(self, depth):
+        self.queue_depth = depth
+
+    def observe_apply_ms(self, apply_ms):
+        self.apply_ms = self._ema(self.apply_ms, apply_ms)
+
+    def observe_encode_ms(self, encode_ms):
+        self.encode_ms = self._ema(self.encode_ms, encode_ms)
+
+    def update(self, now=None):
+        """Ricalcola le impostazioni se è passato update_period, ritorna True se cambiate"""
+        now = time.monotonic() if now is None else now
+        if now - self.last_update < self.update_period:
+            return False
+        self.last_update = now
+
+        interval_ms = self.sync_interval * 1000
+        queue_delay = self.queue_delay()
+        congested = (
+            queue_delay > self.target_delay * 1.5
+            or self.queue_depth > self.max_queue_depth
+            or self.apply_ms > interval_ms
+        )
+        healthy = (
+            queue_delay < self.target_delay
+            and self.queue_depth <= self.max_queue_depth // 2
+            and self.apply_ms < interval_ms * 0.5
+        )
+        encode_heavy = self.encode_ms > interval_ms * 0.25
+
+        old = (self.sync_interval, self.byte_budget, self.compression_level)
+        if congested:
+            # Riduzione moltiplicativa: meno tick e meno byte, più compressione
+            severe = self.queue_depth > self.max_queue_depth * 4
+            factor = 0.5 if severe else 0.7
+            self.sync_interval = min(self.max_interval, self.sync_interval / factor)
+            self.byte_budget = max(self.min_budget, int(self.byte_budget * factor))
+            if not encode_heavy:
+                self.compression_level = min(self.max_compression, self.compression_level + 1)
+            reason = 'congestione'
+        elif healthy:
+            # Aumento additivo verso i limiti configurati; la compressione torna giù
+            self.sync_interval = max(self.min_interval, self.sync_interval - 0.002)
+            self.byte_budget = min(self.max_budget, self.byte_budget + 8 * 1024)
+            self.compression_level = max(self.min_compression, self.compression_level - 1)
+            reason = 'link libero'
+        else:
+            if encode_heavy:
+                self.compression_level = max(self.min_compression, self.compression_level - 1)
+            reason = 'stabile'
+
+        new = (self.sync_interval, self.byte_budget, self.compression_level)
+        if new == old:
+            return False
+
+        decision = {
+            'time': now,
+            'reason': reason,
+            'rtt_ms': None if self.rtt is None else self.rtt * 1000,
+            'queue_delay_ms': queue_delay * 1000,
+            'queue_depth': self.queue_depth,
+            'apply_ms': self.apply_ms,
+            'encode_ms': self.encode_ms,
+            'sync_interval': self.sync_interval,
+            'byte_budget': self.byte_budget,
+            'compression_level': self.compression_level
+        }
+        self.decisions.append(decision)
+        rtt_text = '-' if self.rtt is None else f"{self.rtt * 1000:.0f}ms (+{queue_delay * 1000:.0f})"
+        print(f"📶 Rate control ({reason}): rtt {rtt_text}, coda {self.queue_depth} -> "
+              f"sync {self.sync_interval * 1000:.0f}ms, budget {self.byte_budget // 1024}KB, "
+              f"compressione {self.compression_level}")
+        return True
+
+    def get_state(self):
+        return {
+            'sync_interval': self.sync_interval,
+            'byte_budget': self.byte_budget,
+            'compression_level': self.compression_level,
+            'rtt_ms': None if self.rtt is None else self.rtt * 1000,
+            'base_rtt_ms': None if self.base_rtt is None else self.base_rtt * 1000,
+            'queue_delay_ms': self.queue_delay() * 1000,
+            'queue_depth': self.queue_depth,
+            'apply_ms': self.apply_ms,
+            'encode_ms': self.encode_ms,
+            'decisions': len(self.decisions)
+        }
+
+
+def simulate_link(bandwidth_bps, delay, duration=10.0, delta_bytes_per_tick=48 * 1024,
+                  input_interval=0.008, ping_interval=0.1, max_backlog=1, controller=None):
+    """Sessione simulata master -> client su LinkEmulator con clock virtuale"""
+
+    clock = [0.0]
+    link = LinkEmulator(bandwidth_bps, delay, clock=lambda: clock[0])
+    uplink = LinkEmulator(bandwidth_bps, delay, clock=lambda: clock[0])
+    controller = controller or AdaptiveRateController()
+
+    stats = {'deltas': 0, 'deltas_deferred': 0, 'inputs': 0,
+             'input_latency_max': 0.0, 'delta_latency_max': 0.0}
+    steady_latencies = []
+    steady_inputs = []
+
+    def on_delta(topic, payload):
+        message = decode_message(payload)
+        latency = clock[0] - message['t']
+        stats['deltas'] += 1
+        stats['delta_latency_max'] = max(stats['delta_latency_max'], latency)
+        if message['t'] > duration / 2:
+            steady_latencies.append(latency)
+
+    def on_input(topic, payload):
+        message = decode_message(payload)
+        latency = clock[0] - message['t']
+        stats['inputs'] += 1
+        stats['input_latency_max'] = max(stats['input_latency_max'], latency)
+        if message['t'] > duration / 2:
+            steady_inputs.append(latency)
+
+    def on_ping(topic, payload):
+        uplink.publish('pong', payload)
+
+    def on_pong(topic, payload):
+        # Ping piccoli come quelli del master: l'RTT misura la coda, non la dimensione del delta
+        controller.observe_rtt(clock[0] - decode_message(payload)['t'])
+
+    link.subscribe('delta', on_delta)
+    link.subscribe('input', on_input)
+    link.subscribe('ping', on_ping)
+    uplink.subscribe('pong', on_pong)
+
+    # Dati pseudo-casuali in parte comprimibili, come pagine di memoria
+    filler = bytes(range(256)) * (delta_bytes_per_tick // 512) + bytes(delta_bytes_per_tick // 2)
+
+    step = 0.001
+    next_sync = 0.0
+    next_input = 0.0
+    next_ping = 0.0
+    while clock[0] < duration:
+        if clock[0] >= next_input:
+            # Gli input condividono il link con i delta ma non sono mai limitati
+            link.publish('input', encode_message({'t': clock[0]}))
+            next_input += input_interval
+
+        if clock[0] >= next_ping:
+            link.publish('ping', encode_message({'t': clock[0]}))
+            next_ping += ping_interval
+
+        if clock[0] >= next_sync and link.queue_depth() > max_backlog:
+            # Come il master: niente nuovi delta finché il link ha ancora coda,
+            # così un input aspetta al massimo i delta già in trasmissione
+            stats['deltas_deferred'] += 1
+            next_sync += controller.sync_interval
+        elif clock[0] >= next_sync:
+            size = min(len(filler), controller.byte_budget)
+            started = time.perf_counter()
+            payload = encode_message(
+                {'t': clock[0], 'data': filler[:size].hex()}, controller.compression_level
+            )
+            controller.observe_encode_ms((time.perf_counter() - started) * 1000)
+            link.publish('delta', payload)
+            next_sync += controller.sync_interval
+
+        controller.observe_queue_depth(link.queue_depth())
+        controller.update(now=clock[0])
+        link.pump()
+        uplink.pump()
+        clock[0] += step
+
+    stats['bytes_sent'] = link.bytes_published
+    stats['steady_delta_latency'] = (
+        sum(steady_latencies) / len(steady_latencies) if steady_latencies else None
+    )
+    stats['steady_input_latency'] = (
+        sum(steady_inputs) / len(steady_inputs) if steady_inputs else None
+    )
+    stats['final'] = controller.get_state()
+    return stats
+
+
+if __name__ == "__main__":
+    def ms(value):
+        return '-' if value is None else f"{value * 1000:.0f} ms"
+
+    for bandwidth, delay in ((100_000_000, 0.005), (100_000_000, 0.06),
+                             (10_000_000, 0.02), (2_000_000, 0.06)):
+        result = simulate_link(bandwidth, delay)
+        final = result['final']
+        print(f"📊 {bandwidth / 1e6:.0f} Mbit/s, {delay * 1000:.0f} ms: "
+              f"sync {final['sync_interval'] * 1000:.0f} ms, budget {final['byte_budget'] // 1024} KB, "
+              f"compressione {final['compression_level']}, "
+              f"{result['deltas']} delta ({result['deltas_deferred']} rinviati), "
+              f"latenza delta a regime {ms(result['steady_delta_latency'])} "
+              f"(max {ms(result['delta_latency_max'])}), "
+              f"latenza input a regime {ms(result['steady_input_latency'])} "
+              f"(max {ms(result['input_latency_max'])})")
@@ -0,0 +1,165 @@
+# readiness.py
+import ntpath
+import time
+import zlib
+from memory_backend import LinuxVMBackend
+from region_map import get_region_map
+
+
+class ReadinessProbe:
+    """Attende che il gioco sia pronto invece di una pausa fissa
+
+    Il processo è pronto quando i moduli di gioco sono caricati e le pagine
+    campionate restano (quasi) ferme per quiet_period secondi.
+    """
+
+    def __init__(self, process_id, backend=None, target_modules=('fc26', 'fc24', 'game', 'main', 'engine'),
+                 quiet_period=2.0, timeout=60.0, poll_interval=0.1, sample_pages=64,
+                 change_tolerance=0.05, sample_addresses=None, page_size=4096):
+        self.process_id = process_id
+        self.backend = backend
+        self.target_modules = [target.lower() for target in target_modules]
+        self.quiet_period = quiet_period
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.sample_pages = sample_pages  # pagine campionate per il controllo di quiete
+        self.change_tolerance = change_tolerance  # frazione di pagine che può cambiare
+        self.sample_addresses = sample_addresses  # lista o funzione che la ritorna
+        self.page_size = page_size
+        self.region_map = get_region_map(process_id)
+
+        self.modules = []
+        self.timings = {}
+        self.polls = 0
+
+    def _find_modules(self):
+        """Percorsi mappati che corrispondono ai moduli di gioco"""
+        try:
+            self.region_map.refresh(force=True)
+        except Exception:
+            return None  # processo non ancora ispezionabile
+
+        modules = set()
+        for path in self.region_map.paths:
+            name = ntpath.basename(path).lower()
+            if name and any(target in name for target in self.target_modules):
+                modules.add(path)
+        return sorted(modules)
+
+    def _pick_samples(self):
+        """Pagine scrivibili dei moduli trovati, distribuite uniformemente"""
+        if self.sample_addresses is not None:
+            addresses = self.sample_addresses
+            return list(addresses() if callable(addresses) else addresses)
+
+        modules = set(self.modules)
+        pages = []
+        for start, end, perms, path in self.region_map.regions():
+            if path in modules and 'r' in perms and 'w' in perms:
+                pages.extend(range(start, end, self.page_size))
+
+        if len(pages) <= self.sample_pages:
+            return pages
+        step = len(pages) / self.sample_pages
+        return [pages[int(i * step)] for i in range(self.sample_pages)]
+
+    def _sample(self, addresses):
+        return [
+            None if data is None else zlib.crc32(data)
+            for data in self.backend.read_many(addresses, self.page_size)
+        ]
+
+    def wait(self):
+        """Blocca finché il processo è pronto, ritorna False allo scadere del timeout"""
+        started = time.perf_counter()
+        deadline = started + self.timeout
+        if self.backend is None and LinuxVMBackend.is_supported():
+            self.backend = LinuxVMBackend(self.process_id)
+
+        # Fase 1: moduli di gioco caricati
+        while True:
+            self.polls += 1
+            modules = self._find_modules()
+            if modules:
+                self.modules = modules
+                break
+            if time.perf_counter() >= deadline:
+                self._finish(started, False, 'moduli non trovati')
+                return False
+            time.sleep(self.poll_interval)
+        self.timings['modules_s'] = time.perf_counter() - started
+        print(f"📦 Moduli caricati in {self.timings['modules_s']:.2f}s: "
+              f"{', '.join(ntpath.basename(path) for path in self.modules)}")
+
+        # Fase 2: memoria campionata stabile per quiet_period
+        quiet_started = time.perf_counter()
+        addresses = self._pick_samples() if self.backend is not None else []
+        previous = self._sample(addresses) if addresses else None
+        quiet_since = time.perf_counter()
+        while previous is not None:
+            time.sleep(self.poll_interval)
+            self.polls += 1
+            current = self._sample(addresses)
+            changed = sum(1 for old, new in zip(previous, current) if old != new)
+            previous = current
+            now = time.perf_counter()
+            if changed > len(addresses) * self.change_tolerance:
+                quiet_since = now
+            elif now - quiet_since >= self.quiet_period:
+                break
+            if now >= deadline:
+                self.timings['quiet_s'] = now - quiet_started
+                self._finish(started, False, 'memoria ancora in movimento')
+                return False
+
+        self.timings['quiet_s'] = time.perf_counter() - quiet_started
+        self._finish(started, True)
+        return True
+
+    def _finish(self, started, ready, reason=None):
+        self.timings['total_s'] = time.perf_counter() - started
+        phases = ', '.join(f"{name[:-2]} {value:.2f}s" for name, value in self.timings.items())
+        if ready:
+            print(f"⏱️ Gioco pronto ({phases})")
+        else:
+            print(f"⚠️ Timeout readiness: {reason} ({phases})")
+
+
+if __name__ == "__main__":
+    import subprocess
+    import sys
+
+    # Processo figlio: carica _ctypes dopo un po', poi scrive in memoria e si ferma
+    child_code = (
+        "import sys, time, random\n"
+        "time.sleep(0.5)\n"
+        "import ctypes\n"
+        "buf = ctypes.create_string_buffer(4096 * 16)\n"
+        "print(ctypes.addressof(buf), flush=True)\n"
+        "end = time.time() + 1.5\n"
+        "while time.time() < end:\n"
+        "    ctypes.memmove(buf, random.randbytes(4096 * 16), 4096 * 16)\n"
+        "    time.sleep(0.01)\n"
+        "sys.stdin.read()\n"
+    )
+    spawned = time.perf_counter()
+    child = subprocess.Popen(
+        [sys.executable, '-c', child_code],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+    )
+    try:
+        def buffer_pages():
+            base = int(child.stdout.readline())
+            first = (base + 4095) // 4096 * 4096
+            return [first + i * 4096 for i in range(15)]
+
+        probe = ReadinessProbe(
+            child.pid, target_modules=('_ctypes',), quiet_period=0.5,
+            timeout=10.0, sample_addresses=buffer_pages
+        )
+        ready = probe.wait()
+        print(f"📊 pronto={ready} dopo {time.perf_counter() - spawned:.2f}s dallo spawn "
+              f"({probe.polls} controlli), invece di 5s fissi")
+    finally:
+        child.stdin.close()
+        child.wait()
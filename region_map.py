@@ -0,0 +1,137 @@
+# region_map.py
+import bisect
+import os
+import time
+
+
+class RegionMapCache:
+    """Mappa delle regioni del processo, ordinata per indirizzo con lookup bisect"""
+
+    def __init__(self, process_id, ttl=2.0):
+        self.process_id = process_id
+        self.ttl = ttl  # secondi prima di un refresh automatico
+        self.last_refresh = 0.0
+        self.refresh_count = 0
+
+        # Array paralleli ordinati per indirizzo iniziale
+        self.starts = []
+        self.ends = []
+        self.perms = []
+        self.paths = []
+
+        # Righe già analizzate: 'addr' grezzo -> (start, end, perms, path)
+        self._entries = {}
+
+    def _read_raw_maps(self):
+        """Ritorna la lista di (addr, perms, path, size) grezzi del processo"""
+        maps_path = f"/proc/{self.process_id}/maps"
+        if os.path.exists(maps_path):
+            raw = []
+            with open(maps_path) as f:
+                for line in f:
+                    parts = line.split(None, 5)
+                    path = parts[5].strip() if len(parts) > 5 else ''
+                    raw.append((parts[0], parts[1], path, None))
+            return raw
+
+        # psutil serve solo dove /proc non esiste (Windows)
+        import psutil
+        process = psutil.Process(self.process_id)
+        return [
+            (m.addr, m.perms, m.path, getattr(m, 'rss', None))
+            for m in process.memory_maps(grouped=False)
+        ]
+
+    @staticmethod
+    def _parse(addr, perms, path, size):
+        # Linux: 'start-end', Windows: solo 'start' con la dimensione a parte
+        if '-' in addr:
+            start, end = addr.split('-', 1)
+            start, end = int(start, 16), int(end, 16)
+        else:
+            start = int(addr, 16)
+            end = start + (size or 0)
+        return (start, end, perms, path)
+
+    def refresh(self, force=False):
+        """Aggiorna la mappa se forzato o scaduto il TTL, ritorna True se è cambiata"""
+        if not force and self.starts and time.monotonic() - self.last_refresh < self.ttl:
+            return False
+
+        raw = self._read_raw_maps()
+        self.last_refresh = time.monotonic()
+        self.refresh_count += 1
+
+        # Aggiornamento incrementale: si analizzano solo le righe nuove
+        entries = {}
+        changed = len(raw) != len(self._entries)
+        for addr, perms, path, size in raw:
+            key = (addr, perms, path)
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._parse(addr, perms, path, size)
+                changed = True
+            entries[key] = entry
+
+        if not changed:
+            return False
+
+        self._entries = entries
+        ordered = sorted(entries.values())
+        self.starts = [e[0] for e in ordered]
+        self.ends = [e[1] for e in ordered]
+        self.perms = [e[2] for e in ordered]
+        self.paths = [e[3] for e in ordered]
+        return True
+
+    def _index(self, address):
+        self.refresh()
+        i = bisect.bisect_right(self.starts, address) - 1
+        if i >= 0 and address < self.ends[i]:
+            return i
+        return -1
+
+    def lookup(self, address):
+        """Informazioni sulla regione che contiene l'indirizzo (None se non mappato)"""
+        i = self._index(address)
+        if i < 0:
+            return None
+        return {
+            'address_range': f"{self.starts[i]:x}-{self.ends[i]:x}",
+            'permissions': self.perms[i],
+            'path': self.paths[i],
+            'size': self.ends[i] - self.starts[i]
+        }
+
+    def is_readable(self, address, size=1):
+        """Verifica senza syscall di lettura se l'intervallo è mappato e leggibile"""
+        end = address + size
+        while address < end:
+            i = self._index(address)
+            if i < 0 or 'r' not in self.perms[i]:
+                return False
+            address = self.ends[i]
+        return True
+
+    def regions(self, start=0, end=None):
+        """Itera (start, end, perms, path) delle regioni che intersecano [start, end)"""
+        self.refresh()
+        i = max(bisect.bisect_right(self.starts, start) - 1, 0)
+        while i < len(self.starts):
+            if end is not None and self.starts[i] >= end:
+                break
+            if self.ends[i] > start:
+                yield self.starts[i], self.ends[i], self.perms[i], self.paths[i]
+            i += 1
+
+
+# Cache condivisa per PID tra motore, scanner e funzioni di utilità
+_region_maps = {}
+
+
+def get_region_map(process_id, ttl=2.0):
+    """Ritorna la cache regioni condivisa per il processo"""
+    region_map = _region_maps.get(process_id)
+    if region_map is None:
+        region_map = _region_maps[process_id] = RegionMapCache(process_id, ttl)
+    return region_map
@@ -0,0 +1,216 @@
+# region_profile.py
+import json
+import time
+from collections import defaultdict
+
+
+def module_relative_key(address, modules):
+    """Converte un indirizzo in chiave 'modulo+0xoffset' stabile tra sessioni"""
+    for name, (base, size) in modules.items():
+        if base <= address < base + size:
+            return f"{name}+0x{address - base:X}"
+    return hex(address)
+
+
+def resolve_key(key, modules):
+    """Converte una chiave del profilo in indirizzo assoluto (None se il modulo manca)"""
+    if '+' not in key:
+        return int(key, 16)
+    name, offset = key.rsplit('+', 1)
+    if name not in modules:
+        return None
+    return modules[name][0] + int(offset, 16)
+
+
+class VolatilePageProfiler:
+    """Profila la frequenza di cambiamento di pagine e offset durante una calibrazione"""
+
+    def __init__(self, page_size=4096, noise_threshold=0.9):
+        self.page_size = page_size
+        self.noise_threshold = noise_threshold  # frazione di tick con cambiamenti
+        self.ticks = 0
+        self.started = time.time()
+        self.page_changes = defaultdict(int)
+        self.page_scans = defaultdict(int)  # la corsia bulk a budget non legge tutto ogni tick
+        self.page_bytes = defaultdict(int)
+        self.offset_changes = defaultdict(lambda: defaultdict(int))
+        self.diverged_pages = set()
+
+    def record_tick(self, page_offsets, page_bytes=None, new_tick=True, scanned_pages=None):
+        """Registra i byte cambiati ({pagina: [offset]}) e le pagine confrontate in un tick"""
+        if new_tick:
+            self.ticks += 1
+        for page_addr in scanned_pages or ():
+            self.page_scans[page_addr] += 1
+        page_bytes = page_bytes or {}
+        for page_addr, byte_offsets in page_offsets.items():
+            self.page_changes[page_addr] += 1
+            self.page_bytes[page_addr] += page_bytes.get(page_addr, 0)
+            offsets = self.offset_changes[page_addr]
+            for offset in byte_offsets:
+                offsets[offset] += 1
+
+    def candidate_pages(self):
+        """Pagine che finora cambiano abbastanza spesso da poter essere rumore"""
+        return [
+            page_addr for page_addr in self.page_changes
+            if self.change_rate(page_addr) >= self.noise_threshold
+        ]
+
+    def record_divergence(self, page_addrs):
+        """Segna pagine i cui valori divergono comunque tra le due macchine"""
+        self.diverged_pages.update(page_addrs)
+
+    def scans(self, page_addr):
+        """Quante volte la pagina è stata confrontata (tutti i tick se non registrato)"""
+        return self.page_scans.get(page_addr) or self.ticks
+
+    def change_rate(self, page_addr):
+        """Frazione dei confronti della pagina in cui è cambiata"""
+        scans = self.scans(page_addr)
+        return self.page_changes.get(page_addr, 0) / scans if scans else 0.0
+
+    def classify_page(self, page_addr):
+        """Classifica una pagina come 'noise', 'state' o 'static'"""
+        if not self.ticks or page_addr not in self.page_changes:
+            return 'static'
+
+        if self.change_rate(page_addr) < self.noise_threshold:
+            return 'state'
+
+        # Contatori volatili accanto a stato vero: si mascherano solo gli offset
+        limit = self.noise_threshold * self.scans(page_addr)
+        if any(count < limit for count in self.offset_changes[page_addr].values()):
+            return 'state'
+
+        # Se abbiamo dati di divergenza, è rumore solo se diverge comunque
+        if self.diverged_pages and page_addr not in self.diverged_pages:
+            return 'state'
+        return 'noise'
+
+    def volatile_offsets(self, page_addr):
+        """Offset che cambiano quasi ad ogni tick in una pagina altrimenti stabile"""
+        if not self.ticks:
+            return []
+        limit = self.noise_threshold * self.scans(page_addr)
+        return sorted(
+            offset for offset, count in self.offset_changes.get(page_addr, {}).items()
+            if count >= limit
+        )
+
+    def build_profile(self, modules=None):
+        """Costruisce il profilo regioni serializzabile"""
+        modules = modules or {}
+        pages = {}
+        for page_addr in sorted(self.page_changes):
+            page_class = self.classify_page(page_addr)
+            entry = {
+                'class': page_class,
+                'change_rate': self.change_rate(page_addr),
+                'scans': self.scans(page_addr),
+                'bytes_per_tick': self.page_bytes[page_addr] / self.ticks
+            }
+            # Una pagina che resta uguale sul client è stato sincronizzato: niente maschera
+            in_sync = self.diverged_pages and page_addr not in self.diverged_pages
+            if page_class == 'state' and not in_sync:
+                offsets = self.volatile_offsets(page_addr)
+                if offsets:
+                    entry['volatile_offsets'] = offsets
+            pages[module_relative_key(page_addr, modules)] = entry
+
+        return {
+            'version': 1,
+            'page_size': self.page_size,
+            'ticks': self.ticks,
+            'duration': time.time() - self.started,
+            'noise_threshold': self.noise_threshold,
+            'pages': pages
+        }
+
+    def save(self, path, modules=None):
+        """Scrive il profilo regioni su file"""
+        profile = self.build_profile(modules)
+        with open(path, 'w') as f:
+            json.dump(profile, f, indent=2)
+
+        noise = sum(1 for p in profile['pages'].values() if p['class'] == 'noise')
+        print(f"💾 Profilo regioni salvato: {noise}/{len(profile['pages'])} pagine rumorose ({path})")
+        return profile
+
+
+def load_region_profile(path, modules=None):
+    """Carica un profilo regioni risolvendo gli indirizzi per la sessione corrente"""
+    with open(path) as f:
+        profile = json.load(f)
+
+    modules = modules or {}
+    resolved = {}
+    for key, entry in profile.get('pages', {}).items():
+        page_addr = resolve_key(key, modules)
+        if page_addr is not None:
+            resolved[page_addr] = entry
+
+    profile['resolved_pages'] = resolved
+    return profile
+
+
+def save_region_layout(path, modules, pages, critical_addresses=None, page_size=4096):
+    """Salva il layout regioni come corse di pagine relative ai moduli
+
+    Le pagine fuori dai moduli (scansione euristica) cambiano ad ogni avvio
+    e non vengono salvate; senza pagine relative il file non viene scritto.
+    """
+    runs = []
+    for page_addr in sorted(set(pages)):
+        key = module_relative_key(page_addr, modules)
+        if '+' not in key:
+            continue
+        if runs and runs[-1][2] + runs[-1][1] * page_size == page_addr:
+            runs[-1][1] += 1
+        else:
+            runs.append([key, 1, page_addr])
+    if not runs:
+        return None
+
+    layout = {
+        'version': 1,
+        'page_size': page_size,
+        'modules': {name: size for name, (base, size) in modules.items()},
+        'runs': [[key, count] for key, count, _ in runs],
+        'critical_addresses': {
+            name: module_relative_key(address, modules)
+            for name, address in (critical_addresses or {}).items()
+        },
+        'saved': time.time()
+    }
+    with open(path, 'w') as f:
+        json.dump(layout, f, indent=2)
+
+    print(f"💾 Layout regioni salvato: {sum(count for _, count in layout['runs'])} pagine ({path})")
+    return layout
+
+
+def load_region_layout(path, modules, page_size=4096):
+    """Carica un layout salvato se moduli (nome e dimensione) e pagina coincidono"""
+    try:
+        with open(path) as f:
+            layout = json.load(f)
+    except FileNotFoundError:
+        return None
+
+    current = {name: size for name, (base, size) in modules.items()}
+    if layout.get('page_size') != page_size or layout.get('modules') != current:
+        print("⚠️ Layout regioni obsoleto: moduli diversi, nuova scansione")
+        return None
+
+    pages = []
+    for key, count in layout['runs']:
+        start = resolve_key(key, modules)
+        pages.extend(range(start, start + count * page_size, page_size))
+
+    layout['pages'] = pages
+    layout['critical_addresses'] = {
+        name: resolve_key(key, modules)
+        for name, key in layout.get('critical_addresses', {}).items()
+    }
+    return layout
@@ -1,26 +1,47 @@
 # server_master.py
-import pymem
 import paho.mqtt.client as mqtt
 import json
+import os
 import threading
 import time
 import subprocess
-import psutil
 from collections import defaultdict
 import struct
+from memory_sync import MemorySyncEngine, MemorySignatureScanner
+from fanout import FanoutHub
+from rate_control import AdaptiveRateController
+from transport import encode_message, decode_message
+from lockstep import LockstepSession
+from memory_backend import create_backend
+from readiness import ReadinessProbe
+from profiler import get_profiler
 
 class FCServerMaster:
-    def __init__(self, broker_ip="localhost", game_path="fc26.exe"):
+    def __init__(self, broker_ip="localhost", game_path="fc26.exe", sync_mode="continuous"):
         self.broker_ip = broker_ip
         self.game_path = game_path
+        self.sync_mode = sync_mode  # 'continuous' (delta memoria) o 'lockstep' (input + checksum)
+        self.lockstep = None
+        self.checksum_pages = 64  # pagine confrontate se lo scanner non trova firme
         self.pm = None
         self.game_pid = None
         
-        # Mappa memoria e stati
-        self.memory_regions = []
-        self.memory_snapshot = {}
-        self.dirty_pages = set()
-        self.page_size = 4096
+        # Avvio: attesa del gioco pronto invece di una pausa fissa
+        self.quiet_period = 2.0  # secondi di memoria stabile richiesti
+        self.ready_timeout = 60.0
+        self.startup_timings = {}
+        self.start_time = None
+        self.layout_cache_path = 'region_layout.json'  # layout regioni relativo ai moduli
+        
+        # Strumentazione per fase: spenta di default, metrics_port la attiva
+        self.profiler = get_profiler()
+        self.metrics_port = None  # es. 9126 -> http://127.0.0.1:9126/metrics
+        self.metrics_sample_every = 100  # un tick ogni N con tracciamento allocazioni
+        
+        # Mappa memoria e stati (gestiti dal motore di sincronizzazione)
+        self.sync_engine = None
+        self.critical_addresses = {}
+        self.repair_stats = {'repairs_served': 0, 'pages_sent': 0, 'bytes_sent': 0}
         
         # Input
         self.local_inputs = {}
@@ -35,6 +56,31 @@ class FCServerMaster:
         self.input_interval = 0.008  # 120Hz
         self.running = True
         
+        # Corsie: la critica ogni tick, la bulk con il budget rimanente
+        self.bulk_byte_budget = 64 * 1024  # byte di delta per tick
+        self.bulk_cpu_share = 0.5  # frazione del tick concessa alla bulk
+        self.max_bulk_backlog = 1  # messaggi in coda oltre i quali la bulk salta il tick
+        
+        # Controllo adattivo: sync_interval, compressione e budget seguono il link
+        # entro questi limiti; input_interval resta fisso (priorità agli input)
+        self.rate_controller = AdaptiveRateController(
+            min_interval=self.sync_interval,
+            max_interval=0.1,
+            max_budget=256 * 1024
+        )
+        self.ping_interval = 0.5
+        self.last_ping = 0
+        
+        # Profilo regioni: calibrate=True registra una sessione di calibrazione,
+        # altrimenti region_profile_path (se esiste) viene applicato all'avvio
+        self.calibrate = False
+        self.calibration_seconds = 60.0
+        self.region_profile_path = 'region_profile.json'
+        self.region_profile_mode = 'exclude'
+        self.calibration_end = 0
+        self.divergence_interval = 1.0  # secondi tra due richieste di confronto ai client
+        self.last_divergence_check = 0
+        
     def setup_mqtt(self):
         """Configurazione MQTT Master"""
         self.client.on_connect = self.on_connect
@@ -44,10 +90,22 @@ class FCServerMaster:
         # Topic configurazione
         self.topics = {
             'memory_delta': 'fc26/master/memory_delta',
+            'memory_critical': 'fc26/master/memory_critical',
             'input_from_client': 'fc26/client/input',
             'input_to_client': 'fc26/master/input',
+            'client_memory': 'fc26/client/{session_id}/memory',
+            'ping': 'fc26/master/ping',
+            'calibration': 'fc26/master/calibration',
+            'checksum': 'fc26/master/checksum',
             'control': 'fc26/control'
         }
+        
+        # Un solo encode per delta, distribuito a tutti i client collegati
+        self.fanout = FanoutHub(
+            self.client,
+            {'bulk': self.topics['memory_delta'], 'critical': self.topics['memory_critical']},
+            self.topics['client_memory']
+        )
     
     def on_connect(self, client, userdata, flags, rc):
         print(f"✅ Master connesso al broker MQTT")
@@ -58,18 +116,48 @@ class FCServerMaster:
     def on_message(self, client, userdata, msg):
         """Gestione messaggi in arrivo"""
         try:
-            payload = json.loads(msg.payload.decode())
+            with self.profiler.stage('decode'):
+                payload = decode_message(msg.payload)
             
             if msg.topic == self.topics['input_from_client']:
                 # Input dal client remoto (Controller 2)
                 self.remote_inputs = payload['inputs']
+                if self.lockstep is not None:
+                    self.lockstep.record_remote_inputs(payload)
                 self.inject_remote_inputs()
                 
             elif msg.topic == self.topics['control']:
                 # Messaggi di controllo
-                if payload.get('command') == 'client_ready':
-                    print("🔄 Client pronto, avvio sincronizzazione...")
-                    self.send_initial_snapshot()
+                command = payload.get('command')
+                session_id = payload.get('session_id', 'default')
+                
+                if command == 'client_ready':
+                    session = self.fanout.register_client(session_id, payload.get('role', 'player'))
+                    print(f"🔄 Client {session_id} pronto ({len(self.fanout.sessions)} collegati), "
+                          f"avvio sincronizzazione...")
+                    self.start_snapshot(session)
+                
+                elif command == 'ack':
+                    self.fanout.ack(session_id, payload.get('seqs', {}))
+                    if 'apply_ms' in payload:
+                        self.rate_controller.observe_apply_ms(payload['apply_ms'])
+                
+                elif command == 'pong':
+                    self.rate_controller.observe_rtt(time.time() - payload['t'])
+                
+                elif command == 'repair':
+                    self.send_page_repair(session_id, payload)
+                
+                elif command == 'divergence':
+                    # Pagine che il client non riesce a tenere uguali al master
+                    if self.sync_engine.profiler is not None:
+                        self.sync_engine.profiler.record_divergence(
+                            int(page_addr_hex, 16) for page_addr_hex in payload.get('pages', [])
+                        )
+                
+                elif command == 'client_leave':
+                    self.fanout.remove_client(session_id)
+                    print(f"👋 Client {session_id} disconnesso")
                     
         except Exception as e:
             print(f"❌ Errore messaggio MQTT: {e}")
@@ -78,14 +166,25 @@ class FCServerMaster:
         """Avvia il processo di gioco identico"""
         try:
             print("🎮 Avvio FC26...")
+            started = time.perf_counter()
             process = subprocess.Popen([self.game_path])
             self.game_pid = process.pid
-            time.sleep(5)  # Attendi caricamento
             
-            # Connetti alla memoria del gioco
+            # Connetti alla memoria del gioco (pymem importato solo qui)
+            import pymem
             self.pm = pymem.Pymem()
             self.pm.open_process_from_id(self.game_pid)
             
+            # Attendi moduli caricati e memoria stabile
+            probe = ReadinessProbe(
+                self.game_pid, backend=create_backend(self.pm),
+                quiet_period=self.quiet_period, timeout=self.ready_timeout
+            )
+            if not probe.wait():
+                print("⚠️ Gioco non stabile entro il timeout, proseguo comunque")
+            self.startup_timings.update(probe.timings)
+            self.startup_timings['launch_s'] = time.perf_counter() - started
+            
             print(f"✅ Gioco avviato (PID: {self.game_pid})")
             return True
             
@@ -97,66 +196,119 @@ class FCServerMaster:
         """Identifica le regioni di memoria del gioco"""
         print("🔍 Identificazione regioni memoria...")
         
-        # Filtra solo moduli del gioco
-        for module in self.pm.list_modules():
-            if any(name in module.name.lower() for name in ['fc26', 'game', 'main']):
-                print(f"📦 Modulo trovato: {module.name}")
-                
-                base_addr = module.lpBaseOfDll
-                size = module.SizeOfImage
-                
-                # Aggiungi tutte le pagine del modulo
-                for page_start in range(base_addr, base_addr + size, self.page_size):
-                    self.memory_regions.append(page_start)
-                    
-        print(f"📍 Trovate {len(self.memory_regions)} pagine di memoria")
+        self.sync_engine = MemorySyncEngine(self.pm, role="master")
+        self.sync_engine.sync_interval = self.sync_interval
+        scanner = MemorySignatureScanner(self.pm)
+        
+        # Layout dell'avvio precedente: si riusa se moduli e firme coincidono
+        cached = self.sync_engine.load_layout(self.layout_cache_path)
+        if cached is not None and scanner.verify_addresses(cached):
+            self.critical_addresses = cached
+            self.startup_timings['layout_cache'] = 'warm'
+        else:
+            self.sync_engine.memory_regions = []
+            self.sync_engine.identify_game_memory()
+            
+            # Stato critico risolto dalle firme -> corsia prioritaria
+            self.critical_addresses = scanner.scan_for_signatures()
+            self.startup_timings['layout_cache'] = 'cold'
+        
+        self.sync_engine.optimize_memory_regions(self.critical_addresses)
     
     def create_initial_snapshot(self):
         """Crea snapshot iniziale di tutta la memoria"""
-        print("📸 Creazione snapshot iniziale...")
-        
-        for page_addr in self.memory_regions:
-            try:
-                data = self.pm.read_bytes(page_addr, self.page_size)
-                self.memory_snapshot[page_addr] = data
-            except Exception:
-                continue  # Salva pagine non leggibili
-                
-        print(f"✅ Snapshot creato: {len(self.memory_snapshot)} pagine")
+        self.sync_engine.create_initial_snapshot()
     
-    def send_initial_snapshot(self):
-        """Invia snapshot completo al client"""
-        print("🚀 Invio snapshot iniziale al client...")
+    def start_snapshot(self, session):
+        """Invia lo snapshot in un thread: non blocca il loop MQTT né quello di sync"""
+        threading.Thread(target=self.send_initial_snapshot, args=(session,), daemon=True).start()
+    
+    def send_initial_snapshot(self, session):
+        """Invia snapshot completo solo al client indicato"""
+        print(f"🚀 Invio snapshot iniziale al client {session.session_id}...")
+        
+        # Seq di base presi prima della copia: i delta successivi sono idempotenti
+        base_seq = self.fanout.snapshot_started(session)
+        topic = self.fanout.topic_for(session.session_id)
         
         snapshot_data = {
             'type': 'full_snapshot',
             'timestamp': time.time(),
-            'pages': {}
+            'seq': base_seq,
+            'pages': {},
+            'versions': {}
         }
+        if self.lockstep is not None:
+            # Il client allinea il proprio contatore di frame a quello del master
+            snapshot_data['frame'] = self.lockstep.frame
         
-        # Invia a blocchi per non saturare MQTT
+        # Dati e versioni copiati insieme all'inizio: un blocco non porta mai
+        # byte vecchi con una versione più nuova. Invia a blocchi per non saturare MQTT
         pages_sent = 0
-        for page_addr, data in self.memory_snapshot.items():
+        for page_addr, data, version in self.sync_engine.snapshot_pages():
             snapshot_data['pages'][hex(page_addr)] = data.hex()
+            snapshot_data['versions'][hex(page_addr)] = version
             pages_sent += 1
             
             # Invia ogni 100 pagine
             if pages_sent % 100 == 0:
-                self.client.publish(
-                    self.topics['memory_delta'], 
-                    json.dumps(snapshot_data)
-                )
+                self.client.publish(topic, json.dumps(snapshot_data))
                 snapshot_data['pages'] = {}
+                snapshot_data['versions'] = {}
                 time.sleep(0.01)
         
         # Invia pagine rimanenti
         if snapshot_data['pages']:
-            self.client.publish(
-                self.topics['memory_delta'], 
-                json.dumps(snapshot_data)
-            )
+            self.client.publish(topic, json.dumps(snapshot_data))
         
         print("✅ Snapshot iniziale inviato")
+        
+        if 'first_sync_s' not in self.startup_timings and self.start_time is not None:
+            self.startup_timings['first_sync_s'] = time.perf_counter() - self.start_time
+            print(f"⏱️ Primo sync dopo {self.startup_timings['first_sync_s']:.2f}s dall'avvio "
+                  f"(cache layout {self.startup_timings.get('layout_cache')})")
+    
+    def send_page_repair(self, session_id, request):
+        """Invia al client solo le pagine dei delta persi, alla versione corrente"""
+        session = self.fanout.sessions.get(session_id)
+        if session is None:
+            return
+        
+        known_versions = {
+            int(page_addr_hex, 16): version
+            for page_addr_hex, version in request.get('pages', {}).items()
+        }
+        page_addrs = set(known_versions)
+        if request.get('force'):
+            # Checksum divergente: le versioni del client non bastano, invia comunque
+            known_versions = {}
+            if self.lockstep is not None and 'desyncs' in request:
+                self.lockstep.record_remote_desyncs(session_id, request['desyncs'], len(page_addrs))
+        
+        lane = request.get('lane')
+        if lane is not None:
+            lost_pages = self.fanout.pages_between(lane, request['from_seq'], request['to_seq'])
+            if lost_pages is None:
+                # La history non copre più il buco: snapshot solo per questo client
+                print(f"⚠️ Buco troppo vecchio per {session_id}, invio snapshot dedicato")
+                self.start_snapshot(session)
+                return
+            page_addrs.update(int(page_addr_hex, 16) for page_addr_hex in lost_pages)
+        
+        repair_data = {
+            'type': 'page_repair',
+            'request_id': request.get('request_id'),
+            'timestamp': time.time(),
+            'pages': self.sync_engine.build_page_repair(page_addrs, known_versions)
+        }
+        payload = json.dumps(repair_data)
+        self.client.publish(self.fanout.topic_for(session_id), payload)
+        if self.lockstep is not None:
+            self.lockstep.record_bytes('repair', len(payload))
+        
+        self.repair_stats['repairs_served'] += 1
+        self.repair_stats['pages_sent'] += len(repair_data['pages'])
+        self.repair_stats['bytes_sent'] += len(payload)
     
     def memory_sync_loop(self):
         """Loop principale sincronizzazione memoria"""
@@ -164,46 +316,120 @@ class FCServerMaster:
         
         while self.running:
             try:
-                changes = self.detect_memory_changes()
+                tick_start = time.perf_counter()
+                self.profiler.begin_tick()
+                
+                if self.lockstep is not None:
+                    self.lockstep_tick()
+                    self.profiler.end_tick()
+                    elapsed = time.perf_counter() - tick_start
+                    time.sleep(max(0.0, self.sync_interval - elapsed))
+                    continue
+                
+                # Corsia critica: sempre per prima, payload piccolo
+                changes = self.sync_engine.detect_memory_changes(lane='critical')
                 if changes:
-                    self.send_memory_changes(changes)
-                    
-                time.sleep(self.sync_interval)
+                    self.send_memory_changes(changes, lane='critical')
+                
+                # Corsia bulk: usa il tempo e i byte rimanenti del tick, ma non
+                # accoda dietro delta ancora in uscita (gli input aspetterebbero)
+                if self.fanout.queue_depth() <= self.max_bulk_backlog:
+                    deadline = tick_start + self.sync_interval * self.bulk_cpu_share
+                    changes = self.sync_engine.detect_memory_changes(
+                        lane='bulk',
+                        byte_budget=self.bulk_byte_budget,
+                        deadline=deadline
+                    )
+                    if changes:
+                        self.send_memory_changes(changes, lane='bulk')
+                
+                self.update_rate_control()
+                self.update_calibration()
+                
+                # Client rimasti indietro: catch-up dedicato o snapshot solo per loro
+                for session_id in self.fanout.expire_sessions():
+                    print(f"👋 Client {session_id} scaduto (nessun ack), rimosso")
+                for session in self.fanout.check_lagging():
+                    self.start_snapshot(session)
+                
+                self.profiler.end_tick()
+                elapsed = time.perf_counter() - tick_start
+                time.sleep(max(0.0, self.sync_interval - elapsed))
                 
             except Exception as e:
+                self.profiler.end_tick()
                 print(f"❌ Errore sync memoria: {e}")
                 time.sleep(0.1)
     
+    def lockstep_tick(self):
+        """Un frame in lockstep: niente delta, solo checksum periodici"""
+        checksum_frame = self.lockstep.next_frame()
+        
+        # Ogni frame: aggiorna snapshot e versioni (servono alle riparazioni) e
+        # misura in byte sul filo il delta che la modalità continua avrebbe inviato
+        changes = self.sync_engine.detect_memory_changes()
+        if changes:
+            delta_data = {
+                'type': 'delta_changes',
+                'timestamp': time.time(),
+                'lane': 'bulk',
+                'seq': self.lockstep.frame,
+                'changes': {hex(page_addr): change_info for page_addr, change_info in changes.items()}
+            }
+            self.lockstep.record_continuous_estimate(
+                len(encode_message(delta_data, self.fanout.compression_level))
+            )
+        
+        if not checksum_frame:
+            return
+        
+        pages = self.sync_engine.critical_regions or self.sync_engine.memory_regions[:self.checksum_pages]
+        payload = json.dumps(self.lockstep.build_checksum(pages))
+        self.client.publish(self.topics['checksum'], payload)
+        self.lockstep.record_bytes('checksum', len(payload))
+    
+    def update_rate_control(self):
+        """Misura il link e applica le decisioni del controllo adattivo"""
+        now = time.time()
+        if now - self.last_ping >= self.ping_interval:
+            self.last_ping = now
+            self.client.publish(self.topics['ping'], json.dumps({'command': 'ping', 't': now}))
+        
+        self.rate_controller.observe_queue_depth(self.fanout.queue_depth())
+        self.rate_controller.observe_encode_ms(self.fanout.last_encode_ms)
+        
+        if self.rate_controller.update():
+            self.sync_interval = self.rate_controller.sync_interval
+            self.sync_engine.sync_interval = self.sync_interval
+            self.bulk_byte_budget = self.rate_controller.byte_budget
+            self.fanout.compression_level = self.rate_controller.compression_level
+    
+    def update_calibration(self):
+        """Chiede ai client le pagine divergenti e chiude la calibrazione allo scadere"""
+        if self.sync_engine.profiler is None:
+            return
+        
+        now = time.time()
+        if now >= self.calibration_end:
+            self.sync_engine.stop_profiling(self.region_profile_path)
+            self.sync_engine.apply_region_profile(self.region_profile_path, self.region_profile_mode)
+            self.calibrate = False
+            return
+        
+        if now - self.last_divergence_check >= self.divergence_interval:
+            self.last_divergence_check = now
+            pages = self.sync_engine.profiler.candidate_pages()
+            if pages:
+                check_msg = {'command': 'divergence_check', 'pages': [hex(page_addr) for page_addr in pages]}
+                self.client.publish(self.topics['calibration'], json.dumps(check_msg))
+    
     def detect_memory_changes(self):
         """Rileva cambiamenti nella memoria"""
-        changes = {}
-        
-        for page_addr in self.memory_regions:
-            try:
-                current_data = self.pm.read_bytes(page_addr, self.page_size)
-                old_data = self.memory_snapshot.get(page_addr)
-                
-                if old_data and current_data != old_data:
-                    # Trova byte modificati
-                    byte_changes = []
-                    for i, (old_byte, new_byte) in enumerate(zip(old_data, current_data)):
-                        if old_byte != new_byte:
-                            byte_changes.append((i, new_byte))
-                    
-                    if byte_changes:
-                        changes[page_addr] = {
-                            'changes': byte_changes,
-                            'full_size': len(current_data)
-                        }
-                        self.memory_snapshot[page_addr] = current_data
-                        
-            except Exception:
-                continue
-                
-        return changes
+        return self.sync_engine.detect_memory_changes()
     
-    def send_memory_changes(self, changes):
-        """Invia delta changes al client"""
+    def send_memory_changes(self, changes, lane='bulk'):
+        """Invia delta changes a tutti i client sulla topic della corsia"""
+        started = time.perf_counter()
         delta_data = {
             'type': 'delta_changes',
             'timestamp': time.time(),
@@ -213,10 +439,26 @@ class FCServerMaster:
         for page_addr, change_info in changes.items():
             delta_data['changes'][hex(page_addr)] = change_info
         
-        self.client.publish(
-            self.topics['memory_delta'], 
-            json.dumps(delta_data)
-        )
+        payload = self.fanout.publish_delta(delta_data, lane)
+        
+        # Latenza e byte effettivi sul filo per corsia
+        self.sync_engine.record_lane_publish(lane, len(payload), time.perf_counter() - started)
+    
+    def get_sync_stats(self):
+        """Statistiche di sincronizzazione, incluse quelle per corsia"""
+        if self.sync_engine is None:
+            return {}
+        stats = self.sync_engine.get_sync_stats()
+        stats['fanout'] = self.fanout.get_stats()
+        stats['repairs'] = self.repair_stats.copy()
+        stats['rate_control'] = self.rate_controller.get_state()
+        stats['sync_mode'] = self.sync_mode
+        stats['startup'] = dict(self.startup_timings)
+        if self.profiler.enabled:
+            stats['stages'] = self.profiler.to_dict()['stages']
+        if self.lockstep is not None:
+            stats['lockstep'] = self.lockstep.get_stats()
+        return stats
     
     def input_capture_loop(self):
         """Loop cattura input locale (Controller 1)"""
@@ -236,10 +478,12 @@ class FCServerMaster:
                         'inputs': local_inputs,
                         'timestamp': time.time()
                     }
-                    self.client.publish(
-                        self.topics['input_to_client'],
-                        json.dumps(input_data)
-                    )
+                    if self.lockstep is not None:
+                        self.lockstep.tag_inputs(input_data)
+                    payload = json.dumps(input_data)
+                    self.client.publish(self.topics['input_to_client'], payload)
+                    if self.lockstep is not None:
+                        self.lockstep.record_bytes('inputs', len(payload))
                     
                 time.sleep(self.input_interval)
                 
@@ -275,12 +519,39 @@ class FCServerMaster:
     def start(self):
         """Avvia tutto il sistema master"""
         print("🚀 Avvio Server Master FC26...")
+        self.start_time = time.perf_counter()
+        if self.metrics_port is not None:
+            self.profiler.enable(sample_every=self.metrics_sample_every)
+            self.profiler.serve(self.metrics_port)
         
         if not self.launch_game():
             return False
         
+        started = time.perf_counter()
         self.identify_memory_regions()
+        self.startup_timings['regions_s'] = time.perf_counter() - started
+        
+        started = time.perf_counter()
         self.create_initial_snapshot()
+        self.startup_timings['snapshot_s'] = time.perf_counter() - started
+        print(f"⏱️ Avvio ({self.startup_timings['layout_cache']}): "
+              f"gioco {self.startup_timings['launch_s']:.2f}s, "
+              f"regioni {self.startup_timings['regions_s']:.2f}s, "
+              f"snapshot {self.startup_timings['snapshot_s']:.2f}s")
+        
+        # Solo le pagine leggibili finiscono nella cache per il prossimo avvio
+        if self.startup_timings['layout_cache'] == 'cold':
+            self.sync_engine.save_layout(self.layout_cache_path, self.critical_addresses)
+        
+        if self.calibrate:
+            self.sync_engine.start_profiling()
+            self.calibration_end = time.time() + self.calibration_seconds
+            print(f"🧪 Calibrazione per {self.calibration_seconds:.0f}s, profilo in {self.region_profile_path}")
+        elif self.region_profile_path and os.path.exists(self.region_profile_path):
+            self.sync_engine.apply_region_profile(self.region_profile_path, self.region_profile_mode)
+        
+        if self.sync_mode == 'lockstep':
+            self.lockstep = LockstepSession(self.sync_engine, is_master=True)
         
         # Avvia thread
         threads = [
@@ -291,7 +562,7 @@ class FCServerMaster:
         for thread in threads:
             thread.start()
         
-        print("✅ Master pronto in attesa del client...")
+        print("✅ Master pronto in attesa dei client...")
         self.client.loop_forever()
         
         return True
@@ -0,0 +1,97 @@
+# transport.py
+import heapq
+import json
+import time
+import zlib
+from collections import defaultdict
+
+
+class InProcessTransport:
+    """Trasporto publish/subscribe in-process con la stessa forma di paho publish()"""
+
+    def __init__(self):
+        self.subscribers = defaultdict(list)
+        self.messages_published = 0
+        self.messages_delivered = 0
+        self.bytes_published = 0
+        self.bytes_delivered = 0
+
+    def subscribe(self, topic, callback):
+        """Registra callback(topic, payload) per una topic"""
+        self.subscribers[topic].append(callback)
+
+    def unsubscribe(self, topic, callback):
+        if callback in self.subscribers.get(topic, []):
+            self.subscribers[topic].remove(callback)
+
+    def publish(self, topic, payload):
+        """Consegna il payload a tutti gli iscritti della topic"""
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self.messages_published += 1
+        self.bytes_published += len(payload)
+
+        for callback in list(self.subscribers.get(topic, [])):
+            self.messages_delivered += 1
+            self.bytes_delivered += len(payload)
+            callback(topic, payload)
+
+
+def encode_message(data, compression_level=0):
+    """Serializza un messaggio in JSON, compresso con zlib se richiesto"""
+    payload = json.dumps(data).encode()
+    if compression_level > 0:
+        payload = zlib.compress(payload, compression_level)
+    return payload
+
+
+def decode_message(payload):
+    """Decodifica un messaggio JSON, compresso o meno"""
+    if isinstance(payload, str):
+        payload = payload.encode()
+    if payload[:1] != b'{':
+        payload = zlib.decompress(payload)
+    return json.loads(payload)
+
+
+class LinkEmulator(InProcessTransport):
+    """Collegamento emulato con banda e ritardo configurabili (clock virtuale)"""
+
+    def __init__(self, bandwidth_bps=10_000_000, delay=0.02, clock=time.monotonic):
+        super().__init__()
+        self.bandwidth_bps = bandwidth_bps
+        self.delay = delay  # ritardo di propagazione in una direzione
+        self.clock = clock
+        self.link_free_at = 0.0
+        self.in_flight = []  # heap di (istante consegna, ordine, topic, payload)
+        self._order = 0
+
+    def publish(self, topic, payload):
+        """Accoda il payload: parte quando il link è libero, arriva dopo il ritardo"""
+        if isinstance(payload, str):
+            payload = payload.encode()
+        now = self.clock()
+        start = max(now, self.link_free_at)
+        self.link_free_at = start + len(payload) * 8 / self.bandwidth_bps
+        self._order += 1
+        heapq.heappush(self.in_flight, (self.link_free_at + self.delay, self._order, topic, payload))
+        self.messages_published += 1
+        self.bytes_published += len(payload)
+
+    def queue_depth(self):
+        """Messaggi ancora in coda in attesa di trasmissione sul link"""
+        now = self.clock()
+        return sum(1 for deliver_at, _, _, _ in self.in_flight if deliver_at - self.delay > now)
+
+    def pump(self):
+        """Consegna i messaggi arrivati entro l'istante corrente"""
+        now = self.clock()
+        delivered = 0
+        while self.in_flight and self.in_flight[0][0] <= now:
+            _, _, topic, payload = heapq.heappop(self.in_flight)
+            for callback in list(self.subscribers.get(topic, [])):
+                self.messages_delivered += 1
+                self.bytes_delivered += len(payload)
+                callback(topic, payload)
+            delivered += 1
+        return delivered